@@ -0,0 +1,105 @@
+import os
+import sys
+import warnings
+import numpy as np
+from scipy.stats import kendalltau, pearsonr, spearmanr
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the checked functions are imported from the scripts folder
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts"))
+
+import generators
+from correlation_engine import PERFECT_CORRELATION_ULPS, get_correlation_matrix
+
+# checks the correlation engine gives the same results as scipy, pair by pair
+# run it after changing correlation_engine.py, it exits with an error if anything differs
+
+METHODS = {"pearson": pearsonr, "spearman": spearmanr, "kendall": kendalltau}
+
+# how far the engine can be from scipy, the sums are done in a different order so the last few digits can differ
+RELATIVE_TOLERANCE = 1e-9
+ABSOLUTE_TOLERANCE = 1e-12
+
+
+def get_edge_cases():
+	# small tables where scipy has special cases or rounding decides the p value
+	# name -> (x, y), each column of x is compared with each column of y
+	line = np.arange(1.0, 51.0)
+
+	return {
+		"two rows": (np.array([[1.0, 2.0, 5.0], [2.0, 1.0, 5.0]]), np.array([[3.0, 1.0], [1.0, 4.0]])),
+		"three rows in order": (np.array([[1.0, 1.0], [2.0, 2.0], [3.0, 3.0]]), np.array([[1.0, 3.0], [2.0, 2.0], [3.0, 1.0]])),
+		"three rows on a line": (np.array([[1.0], [2.0], [3.0]]), np.array([[2.0, -0.3], [4.0, -0.6], [6.0, -0.9]])),
+		"perfect rank order": (line[:, None], np.column_stack([line ** 3, -np.exp(line / 10), 0.1 * line])),
+		"constant column": (np.column_stack([line, np.full(50, 7.0)]), np.column_stack([line % 7, line])),
+		"ties": (np.column_stack([line // 10, line % 3]), np.column_stack([line // 5, line // 25]))
+	}
+
+
+def get_scipy_matrix(x, y, method, min_sample_size):
+	# the slow way, one scipy call per pair over the rows both columns have
+	shape = (x.shape[1], y.shape[1])
+	correlations = np.full(shape, np.nan)
+	p_values = np.full(shape, np.nan)
+
+	for i in range(x.shape[1]):
+		for j in range(y.shape[1]):
+			rows = ~np.isnan(x[:, i]) & ~np.isnan(y[:, j])
+
+			if rows.sum() < max(min_sample_size, 2):
+				continue
+
+			correlations[i, j], p_values[i, j] = METHODS[method](x[rows, i], y[rows, j])
+
+	return correlations, p_values
+
+
+def compare(name, x, y, min_sample_size):
+	# prints how far off each method is and gives back whether they all match
+	matches = True
+
+	for method in METHODS:
+		with warnings.catch_warnings():
+			# scipy warns about constant columns, which are part of what's checked
+			warnings.simplefilter("ignore")
+			expected = get_scipy_matrix(x, y, method, min_sample_size)
+
+		actual = get_correlation_matrix(x, y, method, min_sample_size)[:2]
+
+		# scipy's pearsonr can round a perfect correlation a little under 1, the engine counts it as perfect with a p value of 0
+		perfect = np.abs(expected[0]) >= 1.0 - PERFECT_CORRELATION_ULPS * np.finfo(np.float64).eps
+
+		for label, actual_values, expected_values in zip(("correlation", "p value"), actual, expected):
+			same = np.isclose(actual_values, expected_values, rtol=RELATIVE_TOLERANCE, atol=ABSOLUTE_TOLERANCE, equal_nan=True)
+
+			if label == "p value":
+				same |= perfect & (actual_values == 0)
+
+			if same.all():
+				continue
+
+			matches = False
+
+			for i, j in zip(*np.nonzero(~same)):
+				print(f"{name}, {method} {label} of x{i} and y{j}: got {actual_values[i, j]!r}, scipy gives {expected_values[i, j]!r}")
+
+	print(f"{name}: {'same as scipy' if matches else 'different from scipy'}")
+
+	return matches
+
+
+def main():
+	results = [compare(name, x, y, 2) for name, (x, y) in get_edge_cases().items()]
+
+	# tables shaped like the real ones, with missing values and ties
+	for seed in range(3):
+		df_messages, df_music = generators.make_feature_tables(200, seed=seed)
+		results.append(compare(f"feature tables {seed}", df_messages.to_numpy(), df_music.to_numpy(), 30))
+
+	if not all(results):
+		sys.exit("The correlation engine doesn't match scipy")
+
+
+if __name__ == "__main__":
+	main()
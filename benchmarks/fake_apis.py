@@ -0,0 +1,240 @@
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from dotenv import load_dotenv
+
+# local stand-ins for the spotify web api, reccobeats and top.gg, so the scripts can run without accounts or the internet
+# everything is made from the seed, so the same settings always give the same playlists, tracks and servers
+# run it on its own and point the scripts at the urls it prints, or let run_fakes.py start it
+
+# load env variables
+load_dotenv()
+
+# port the fake apis listen on
+FAKE_API_PORT = int(os.getenv("FAKE_API_PORT", "8765"))
+
+# seconds every response is held back, like the round trip to the real apis
+FAKE_API_LATENCY = float(os.getenv("FAKE_API_LATENCY", "0.02"))
+
+# every this many reccobeats requests one gets a 429 with Retry-After 0, so the retries get used (0 never does)
+FAKE_API_RATE_LIMIT_EVERY = int(os.getenv("FAKE_API_RATE_LIMIT_EVERY", "37"))
+
+# spotify users are named user0, user1 and so on, and their playlists share this many tracks
+FAKE_SPOTIFY_USERS = int(os.getenv("FAKE_SPOTIFY_USERS", "30"))
+FAKE_SPOTIFY_TRACKS = int(os.getenv("FAKE_SPOTIFY_TRACKS", "3000"))
+
+# how many servers top.gg lists
+FAKE_TOPGG_SERVERS = int(os.getenv("FAKE_TOPGG_SERVERS", "2350"))
+
+# seed of the fake playlists
+FAKE_API_SEED = int(os.getenv("FAKE_API_SEED", "1"))
+
+AUDIO_FEATURES = ["acousticness", "danceability", "energy", "liveness", "loudness", "mode", "speechiness", "tempo", "valence"]
+
+
+def make_playlists(user_count, track_count, seed):
+	# user id -> [(playlist id, [track id or None for removed tracks])]
+	rng = random.Random(seed)
+	track_ids = [f"t{i:05d}" for i in range(track_count)]
+	users = {}
+
+	for user in range(user_count):
+		playlists = []
+
+		for playlist in range(rng.randint(0, 70)):
+			tracks = [rng.choice(track_ids) if rng.random() > 0.02 else None for _ in range(rng.randint(0, 260))]
+			playlists.append((f"u{user}p{playlist}", tracks))
+
+		users[f"user{user}"] = playlists
+
+	return users
+
+
+def get_track(track_id):
+	# spotify track object, the same every time for the same id
+	rng = random.Random(track_id)
+
+	return {
+		"id": track_id,
+		"popularity": rng.randint(0, 100),
+		"explicit": rng.random() < 0.2,
+		"duration_ms": rng.randint(60000, 400000),
+		"album": {"id": f"al{rng.randint(0, 400)}", "release_date": f"{rng.randint(1960, 2024)}-01-01"},
+		"artists": [{"id": f"ar{rng.randint(0, 200)}"}]
+	}
+
+
+def get_audio_features(track_id):
+	# reccobeats entry for the track, reccobeats doesn't have tracks ending in 7
+	if track_id.endswith("7"):
+		return None
+
+	features = {feature: random.Random(track_id + feature).random() for feature in AUDIO_FEATURES}
+
+	return {"href": f"https://open.spotify.com/track/{track_id}", **features}
+
+
+def get_page(items, query, default_limit, url):
+	# one page of a spotify paging object
+	offset = int(query.get("offset", [0])[0])
+	limit = int(query.get("limit", [default_limit])[0])
+	next_url = f"{url}?offset={offset + limit}&limit={limit}" if offset + limit < len(items) else None
+
+	return {"items": items[offset:offset + limit], "offset": offset, "limit": limit, "total": len(items), "next": next_url}
+
+
+class FakeApis:
+	# the data behind the fake endpoints, and counters of what was asked for
+
+	def __init__(self, port, latency=FAKE_API_LATENCY, rate_limit_every=FAKE_API_RATE_LIMIT_EVERY):
+		self.port = port
+		self.latency = latency
+		self.rate_limit_every = rate_limit_every
+
+		self.users = make_playlists(FAKE_SPOTIFY_USERS, FAKE_SPOTIFY_TRACKS, FAKE_API_SEED)
+		self.playlists = {playlist_id: tracks for playlists in self.users.values() for playlist_id, tracks in playlists}
+
+		# client ports show how many connections were opened, which is how connection reuse is checked
+		self.requests = 0
+		self.audio_feature_requests = 0
+		self.client_ports = set()
+		self.lock = threading.Lock()
+
+	def get_stats(self):
+		with self.lock:
+			return {"requests": self.requests, "connections": len(self.client_ports)}
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, *args):
+		pass
+
+	def send_json(self, data, status=200, headers=None):
+		body = json.dumps(data).encode()
+
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+
+		self.end_headers()
+		self.wfile.write(body)
+
+	def start_request(self):
+		apis = self.server.apis
+		time.sleep(apis.latency)
+
+		with apis.lock:
+			apis.requests += 1
+			apis.client_ports.add(self.client_address[1])
+
+	def do_GET(self):
+		apis = self.server.apis
+		self.start_request()
+
+		url = urlparse(self.path)
+		query = parse_qs(url.query)
+		parts = url.path.strip("/").split("/")
+		base_url = f"http://127.0.0.1:{apis.port}{url.path}"
+
+		if url.path == "/stats":
+			return self.send_json(apis.get_stats())
+
+		# reccobeats
+		if parts[-1] == "audio-features":
+			with apis.lock:
+				apis.audio_feature_requests += 1
+				rate_limited = apis.rate_limit_every and apis.audio_feature_requests % apis.rate_limit_every == 0
+
+			if rate_limited:
+				return self.send_json({}, 429, {"Retry-After": "0"})
+
+			features = [get_audio_features(track_id) for track_id in query["ids"][0].split(",")]
+			return self.send_json({"content": [entry for entry in features if entry is not None]})
+
+		# spotify
+		if len(parts) >= 3 and parts[-3] == "users" and parts[-1] == "playlists":
+			if parts[-2] not in apis.users:
+				return self.send_json({"error": {"status": 404, "message": "Not found."}}, 404)
+
+			playlists = [{"id": playlist_id} for playlist_id, _ in apis.users[parts[-2]]]
+			return self.send_json(get_page(playlists, query, 50, base_url))
+
+		if len(parts) >= 3 and parts[-3] == "playlists" and parts[-1] in ("items", "tracks"):
+			items = [{"track": get_track(track_id) if track_id else None} for track_id in apis.playlists.get(parts[-2], [])]
+			return self.send_json(get_page(items, query, 100, base_url))
+
+		if parts[-1] == "tracks":
+			return self.send_json({"tracks": [get_track(track_id) for track_id in query["ids"][0].split(",")]})
+
+		self.send_json({"error": {"status": 404, "message": "Not found."}}, 404)
+
+	def do_POST(self):
+		apis = self.server.apis
+		self.start_request()
+
+		body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		path = urlparse(self.path).path
+
+		# spotify client credentials
+		if path == "/api/token":
+			return self.send_json({"access_token": "fake", "token_type": "Bearer", "expires_in": 3600})
+
+		# top.gg listing, which takes longer for bigger pages like the real one
+		if path == "/graphql":
+			page = json.loads(body)["variables"]["input"]
+			time.sleep(page["limit"] * 0.002)
+
+			servers = range(page["skip"], min(FAKE_TOPGG_SERVERS, page["skip"] + page["limit"]))
+			nodes = [{"id": str(i), "name": f"server {i}", "inviteCode": f"invite{i}"} for i in servers]
+
+			return self.send_json({"data": {"entitiesV2": {"nodes": nodes}}})
+
+		self.send_json({"error": {"status": 404, "message": "Not found."}}, 404)
+
+
+def start_server(port=FAKE_API_PORT):
+	# serves the fake apis from a background thread, call shutdown on the server to stop it
+	server = ThreadingHTTPServer(("127.0.0.1", port), FakeApiHandler)
+	server.daemon_threads = True
+	server.apis = FakeApis(server.server_address[1])
+
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	return server
+
+
+def get_urls(port):
+	# env variables that point the scripts at the fake apis
+	return {
+		"SPOTIFY_API_URL": f"http://127.0.0.1:{port}/v1/",
+		"SPOTIFY_TOKEN_URL": f"http://127.0.0.1:{port}/api/token",
+		"RECCOBEATS_URL": f"http://127.0.0.1:{port}/v1/audio-features",
+		"TOPGG_API_URL": f"http://127.0.0.1:{port}/graphql"
+	}
+
+
+def main():
+	server = start_server()
+	print(f"Fake apis listening on port {server.server_address[1]} with {FAKE_SPOTIFY_USERS} spotify users")
+
+	for name, url in get_urls(server.server_address[1]).items():
+		print(f"{name}={url}")
+
+	try:
+		while True:
+			time.sleep(60)
+	except KeyboardInterrupt:
+		server.shutdown()
+
+
+if __name__ == "__main__":
+	main()
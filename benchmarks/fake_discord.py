@@ -0,0 +1,177 @@
+import asyncio
+import enum
+import random
+import sys
+import types
+
+# a stand-in for the parts of discord.py-self get_user_sample uses, with made up servers, channels and profiles
+# importing this module installs it as discord, so do it before importing get_user_sample
+# set guilds to the servers the client should see, make_guild builds them from a seed
+
+# servers every Client sees, set before the client is made
+guilds = []
+
+
+class ChannelType(enum.Enum):
+	text = 0
+	voice = 2
+	category = 4
+	news = 5
+
+
+class ConnectionType(enum.Enum):
+	spotify = "spotify"
+	steam = "steam"
+
+
+class Object:
+	# what get_user_sample passes as before= when picking up a channel from the checkpoint
+
+	def __init__(self, id):
+		self.id = id
+
+
+class RateLimited(Exception):
+	# looks like the 429 discord.py raises, so the profile lookup retries it
+	status = 429
+
+	def __init__(self, retry_after):
+		super().__init__(f"rate limited for {retry_after}s")
+		self.retry_after = retry_after
+
+
+class NotFound(Exception):
+	status = 404
+
+
+class Client:
+	# run calls on_ready like the real client does once it's logged in
+	# the real client keeps running until it's closed, so here on_ready finishing without closing it is an error instead of a hang
+
+	def __init__(self, *args, **kwargs):
+		self.guilds = list(guilds)
+		self.guilds_by_id = {guild.id: guild for guild in self.guilds}
+		self.user = "fake user"
+		self.closed = False
+
+		# every author of every server, including the ones who left
+		self.authors = {author.id: author for guild in self.guilds for author in guild.all_authors}
+
+	def get_guild(self, id):
+		return self.guilds_by_id[id]
+
+	def run(self, token):
+		asyncio.run(self.on_ready())
+
+		if not self.closed:
+			raise RuntimeError("on_ready finished without closing the client, the real client would never return from run")
+
+	async def close(self):
+		self.closed = True
+
+	async def fetch_user_profile(self, id):
+		return await self.authors[id].profile()
+
+
+class Author:
+	# kind is "spotify" or "none" for the connections their profile has, "fail" when it can't be fetched
+	# and "rate_limited" when the first lookup is rate limited
+	# authors who left still have their messages, but aren't members of the server anymore
+
+	def __init__(self, id, bot, kind, spotify_user, left=False):
+		self.id = id
+		self.name = f"user {id}"
+		self.bot = bot
+		self.kind = kind
+		self.spotify_user = spotify_user
+		self.left = left
+		self.lookups = 0
+
+	async def profile(self):
+		await asyncio.sleep(0)
+		self.lookups += 1
+
+		if self.kind == "fail":
+			raise RuntimeError("profile not found")
+
+		if self.kind == "rate_limited" and self.lookups == 1:
+			raise RateLimited(0)
+
+		connections = [types.SimpleNamespace(type=ConnectionType.steam, url="https://steamcommunity.com/id/fake")]
+
+		if self.kind == "spotify":
+			connections.append(types.SimpleNamespace(type=ConnectionType.spotify, url=f"https://open.spotify.com/user/{self.spotify_user}"))
+
+		return types.SimpleNamespace(connections=connections)
+
+
+class Channel:
+	# messages are newest first like history gives them, each one waits up to delay seconds
+
+	def __init__(self, id, name, type, messages, writable, delay):
+		self.id = id
+		self.name = name
+		self.type = type
+		self.messages = messages
+		self.writable = writable
+		self.delay = delay
+
+	def permissions_for(self, member):
+		return types.SimpleNamespace(send_messages=self.writable)
+
+	async def history(self, limit=None, before=None):
+		messages = self.messages if before is None else [message for message in self.messages if message.id < before.id]
+
+		for message in messages[:limit]:
+			await asyncio.sleep(self.delay * random.random())
+			yield message
+
+
+class Guild:
+	def __init__(self, id, channels, authors):
+		self.id = id
+		self.me = None
+		self.channels = channels
+		self.all_authors = authors
+		self.members = {author.id: author for author in authors if not author.left}
+
+	def __str__(self):
+		return f"server {self.id}"
+
+	async def fetch_channels(self):
+		return self.channels
+
+	async def fetch_member(self, id):
+		if id not in self.members:
+			raise NotFound("unknown member")
+
+		return self.members[id]
+
+
+def make_guild(seed, channel_count=6, author_count=30, message_count=200, delay=0.001, spotify_users=30):
+	# a server where about a fifth of the authors have spotify, linked to the fake apis' user0 to user{spotify_users - 1}
+	# one channel is a voice channel and one can't be written in, so both get skipped, and every seventh author has left the server
+	rng = random.Random(seed)
+	kinds = ["none", "spotify", "fail", "none", "rate_limited"]
+
+	authors = [
+		Author(seed * 1000 + i, rng.random() < 0.1, rng.choice(kinds), f"user{(seed * 1000 + i) % spotify_users}", i % 7 == 0)
+		for i in range(author_count)
+	]
+
+	channels = []
+
+	for i in range(channel_count):
+		messages = [
+			types.SimpleNamespace(id=10 ** 9 - k, author=rng.choice(authors), content=f"server {seed} channel {i} message {k}")
+			for k in range(message_count)
+		]
+		channel_type = ChannelType.voice if i == 4 else ChannelType.text
+
+		channels.append(Channel(seed * 100 + i, f"channel-{i}", channel_type, messages, i != 3, delay))
+
+	return Guild(seed, channels, authors)
+
+
+# the real discord module is replaced, get_user_sample only needs these names
+sys.modules["discord"] = sys.modules[__name__]
@@ -0,0 +1,207 @@
+import json
+import numpy as np
+import pandas as pd
+
+# synthetic data shaped like what the scripts get, so benchmarks don't need discord or spotify
+# everything comes from a seeded generator, so the same seed and size always give the same data
+
+WORDS = [
+	"the", "i", "you", "to", "a", "it", "and", "is", "that", "lol", "of", "in", "for", "this", "me", "my", "so", "be", "what", "just",
+	"not", "no", "on", "do", "was", "have", "but", "like", "yeah", "with", "are", "can", "get", "if", "we", "they", "game", "its",
+	"all", "one", "how", "he", "at", "good", "im", "dont", "now", "gg", "bro", "why", "really", "server", "play", "time", "u", "ok",
+	"think", "know", "people", "would", "song", "music", "playlist", "listening", "discord", "anyone", "tonight", "wanna", "fr",
+	"literally", "actually", "probably", "honestly", "beautiful", "unfortunately", "incredible", "ridiculous", "understand",
+	"definitely", "conversation", "experience", "absolutely", "everything", "something", "@everyone", "<:pepe:123456>", "😂", "💀",
+	"https://tenor.com/view/cat", "ur", "lmao", "omg", "nah"
+]
+
+# short messages people send over and over
+COMMON_MESSAGES = ["lol", "gg", "ok", "lmao", "yes", "no", "😂", "bruh", "ty", "same"]
+
+
+def get_zipf_indexes(rng, count, size, exponent=1.1):
+	# indexes below size where a few come up a lot and most rarely, like words, artists and tracks do
+	ranks = np.arange(1, size + 1, dtype=np.float64)
+	probabilities = ranks ** -exponent
+	probabilities /= probabilities.sum()
+
+	return rng.choice(size, size=count, p=probabilities)
+
+
+def make_messages(count, seed=0):
+	# discord-like messages, mostly short chat with some repeated reactions, mentions, emojis and links
+	rng = np.random.default_rng(seed)
+
+	lengths = rng.geometric(0.15, size=count)
+	word_indexes = get_zipf_indexes(rng, int(lengths.sum()), len(WORDS))
+	common = rng.random(count) < 0.1
+	common_indexes = rng.integers(0, len(COMMON_MESSAGES), size=count)
+	shouting = rng.random(count) < 0.05
+
+	messages = []
+	position = 0
+
+	for i in range(count):
+		words = [WORDS[index] for index in word_indexes[position:position + lengths[i]]]
+		position += lengths[i]
+
+		if common[i]:
+			message = COMMON_MESSAGES[common_indexes[i]]
+		else:
+			message = " ".join(words)
+
+			if shouting[i]:
+				message = message.upper()
+			elif lengths[i] > 4:
+				message = message.capitalize() + "."
+
+		messages.append(message)
+
+	return messages
+
+
+def make_playlist_tracks(count, seed=0):
+	# spotify playlist items with count tracks, a third of them unique, with a few removed tracks and local files
+	rng = np.random.default_rng(seed)
+
+	unique_tracks = max(count // 3, 1)
+	track_indexes = get_zipf_indexes(rng, count, unique_tracks, 0.8)
+
+	# every track has one album and artist, which are shared between tracks
+	artist_indexes = get_zipf_indexes(rng, unique_tracks, max(unique_tracks // 8, 1))
+	album_indexes = rng.integers(0, max(unique_tracks // 3, 1), size=unique_tracks)
+
+	# items of the same track share its dict, so big payloads fit in memory
+	tracks = [
+		{
+			"id": f"track{i:022d}",
+			"artists": [{"id": f"artist{artist_indexes[i]:021d}"}],
+			"album": {"id": f"album{album_indexes[i]:022d}"}
+		}
+		for i in range(unique_tracks)
+	]
+
+	# local files have no ids
+	local_track = {"id": None, "artists": [{"id": None}], "album": {"id": None}}
+
+	removed = rng.random(count) < 0.01
+	local = rng.random(count) < 0.01
+
+	items = []
+
+	for i in range(count):
+		if removed[i]:
+			items.append({"track": None})
+		elif local[i]:
+			items.append({"track": local_track})
+		else:
+			items.append({"track": tracks[track_indexes[i]]})
+
+	return items
+
+
+def make_track_data(track_ids, seed=0):
+	# reccobeats audio features and spotify metadata for the tracks, some missing from each source like the real ones
+	rng = np.random.default_rng(seed)
+	count = len(track_ids)
+
+	audio = rng.random((count, 9))
+	has_audio = rng.random(count) < 0.8
+	has_metadata = rng.random(count) < 0.97
+
+	popularity = rng.integers(0, 100, size=count)
+	duration = rng.integers(60000, 420000, size=count)
+	explicit = rng.random(count) < 0.3
+	release_year = rng.integers(1960, 2025, size=count)
+
+	tracks_data = {}
+	tracks_metadata = {}
+
+	for i, tid in enumerate(track_ids):
+		if has_audio[i]:
+			tracks_data[tid] = {
+				"acousticness": audio[i, 0],
+				"danceability": audio[i, 1],
+				"energy": audio[i, 2],
+				"liveness": audio[i, 3],
+				"loudness": -60 * audio[i, 4],
+				"mode": int(audio[i, 5] < 0.6),
+				"speechiness": audio[i, 6],
+				"tempo": 60 + 140 * audio[i, 7],
+				"valence": audio[i, 8]
+			}
+
+		if has_metadata[i]:
+			tracks_metadata[tid] = {
+				"id": tid,
+				"popularity": int(popularity[i]),
+				"explicit": int(explicit[i]),
+				"duration_ms": int(duration[i]),
+				"release_year": int(release_year[i])
+			}
+
+	return tracks_data, tracks_metadata
+
+
+def make_feature_tables(rows, message_columns=8, music_columns=6, seed=0):
+	# message and music tables like the ones the correlations are calculated between, one row per user
+	# music properties are missing together for users without spotify, and some properties are missing here and there
+	# some columns are whole numbers with lots of ties, like counts and flags
+	rng = np.random.default_rng(seed)
+
+	# a shared factor so some pairs are actually correlated
+	shared = rng.standard_normal(rows)
+
+	messages = shared[:, None] * rng.uniform(0, 0.5, size=message_columns) + rng.standard_normal((rows, message_columns))
+	music = shared[:, None] * rng.uniform(0, 0.5, size=music_columns) + rng.standard_normal((rows, music_columns))
+
+	messages[:, ::4] = np.round(messages[:, ::4] * 3)
+	music[:, ::3] = np.round(music[:, ::3] * 2)
+
+	music[rng.random(rows) < 0.3] = np.nan
+	messages[rng.random((rows, message_columns)) < 0.02] = np.nan
+
+	df_messages = pd.DataFrame(messages, columns=[f"message_metric_{i}" for i in range(message_columns)])
+	df_music = pd.DataFrame(music, columns=[f"music_metric_{i}" for i in range(music_columns)])
+
+	return df_messages, df_music
+
+
+def make_value_table(rows, columns=20, seed=0):
+	# properties by values with some missing, and how many times each value appears, like get_distributions takes them
+	rng = np.random.default_rng(seed)
+
+	values = rng.standard_normal((columns, rows))
+	values[:, ::2] = np.round(values[:, ::2] * 4)
+	values[rng.random((columns, rows)) < 0.05] = np.nan
+
+	weights = rng.integers(1, 4, size=rows).astype(np.float64)
+
+	return values, [f"property_{i}" for i in range(columns)], weights
+
+
+def write_users_file(path, message_count, seed=0, messages_per_user=290, users_per_server=100):
+	# a users.json like get_user_sample saves, with message_count messages split evenly between the sampled users
+	# servers are written one at a time, so big files don't have to fit in memory while they're made
+	user_count = max(message_count // messages_per_user, 1)
+	messages = make_messages(message_count, seed)
+
+	with open(path, "w", encoding="utf-8") as f:
+		f.write("[")
+
+		for first_user in range(0, user_count, users_per_server):
+			strata = {"spotify_sample": {}, "non_spotify_sample": {}}
+
+			for i in range(first_user, min(first_user + users_per_server, user_count)):
+				user_id = str(10 ** 17 + i)
+				user = {"user": f"user {i}", "messages": messages[i * message_count // user_count:(i + 1) * message_count // user_count]}
+
+				# every other user has spotify
+				if i % 2 == 0:
+					strata["spotify_sample"][user_id] = {"spotifyUrl": f"https://open.spotify.com/user/{user_id}"} | user
+				else:
+					strata["non_spotify_sample"][user_id] = user
+
+			f.write(("," if first_user else "") + json.dumps({"guild": f"server {first_user // users_per_server}", **strata}, ensure_ascii=False))
+
+		f.write("]")
@@ -0,0 +1,390 @@
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the benchmarked functions are imported from the scripts folder
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts"))
+
+import generators
+
+# load env variables
+load_dotenv()
+
+# the scripts read these on import, they don't change anything that's benchmarked
+os.environ.setdefault("SPOTIFY_BATCH_SIZE", "100")
+os.environ.setdefault("MIN_PROPERTY_SAMPLE_SIZE", "30")
+
+# comma separated sizes to run every benchmark at (rows, messages, tracks or ids, depending on the benchmark)
+BENCHMARK_SCALES = [int(scale) for scale in os.getenv("BENCHMARK_SCALES", "1000,100000,1000000").split(",")]
+
+# comma separated benchmarks to run (empty runs all of them)
+BENCHMARK_NAMES = os.getenv("BENCHMARK_NAMES", "")
+
+# how many times each benchmark is timed, the median is what gets compared
+BENCHMARK_REPEATS = int(os.getenv("BENCHMARK_REPEATS", "3"))
+
+# seed of the synthetic data, keep it the same to compare runs
+BENCHMARK_SEED = int(os.getenv("BENCHMARK_SEED", "0"))
+
+# results are saved here, one file per commit
+BENCHMARK_RESULTS_DIR = os.getenv("BENCHMARK_RESULTS_DIR", "data/benchmarks")
+
+# results file of an earlier run to compare against (empty skips the comparison)
+BENCHMARK_BASELINE = os.getenv("BENCHMARK_BASELINE", "")
+
+# synthetic input files are made once per size and seed, and removed when the run ends
+files_dir = None
+
+
+def setup_analyze_user(scale, seed):
+	import analyze_messages
+
+	return analyze_messages, generators.make_messages(scale, seed)
+
+
+def run_analyze_user(analyze_messages, messages):
+	# start without any remembered messages so every run does the same work
+	analyze_messages.message_memo.clear()
+	analyze_messages.analyze_user(messages)
+
+
+def run_analyze_user_per_message(analyze_messages, messages):
+	# the same as analyze_user with BATCH_MESSAGE_ANALYSIS=0
+	batch = analyze_messages.BATCH_MESSAGE_ANALYSIS
+	analyze_messages.BATCH_MESSAGE_ANALYSIS = False
+
+	try:
+		run_analyze_user(analyze_messages, messages)
+	finally:
+		analyze_messages.BATCH_MESSAGE_ANALYSIS = batch
+
+
+# the message features computed differently by the batched and per message paths, plus vader which is the same on both
+# textstat and textblob are left out, they run per message either way and need nltk corpora that aren't always there
+def run_batched_message_features(analyze_messages, messages):
+	analyze_messages.predict_profanity_prob(messages)
+	analyze_messages.get_character_ratios(messages)
+
+	for message in messages:
+		analyze_messages.get_polarity_scores(message)
+
+
+def run_per_message_features(analyze_messages, messages):
+	for message in messages:
+		analyze_messages.predict_profanity_prob([message])
+		analyze_messages.get_polarity_scores(message)
+		analyze_messages.get_uppercase_ratio(message)
+		analyze_messages.get_alpha_ratio(message)
+		analyze_messages.get_ascii_ratio(message)
+
+
+def setup_users_file(scale, seed):
+	global files_dir
+
+	if files_dir is None:
+		files_dir = tempfile.TemporaryDirectory(prefix="benchmarks-")
+
+	path = os.path.join(files_dir.name, f"users_{scale}_{seed}.json")
+
+	if not os.path.exists(path):
+		generators.write_users_file(path, scale, seed)
+
+	return (path,)
+
+
+def run_load_users(path):
+	# how users.json was read before iter_users
+	with open(path, "r", encoding="utf-8") as f:
+		servers = json.load(f)
+
+	for server in servers:
+		for stratum in ("spotify_sample", "non_spotify_sample"):
+			for user in server[stratum].values():
+				len(user["messages"])
+
+
+def run_stream_users(path):
+	from users_reader import iter_users
+
+	for _, _, _, user in iter_users(path):
+		len(user["messages"])
+
+
+def setup_get_distributions(scale, seed):
+	from distribution_stats import get_distributions
+
+	return (get_distributions, *generators.make_value_table(scale, seed=seed))
+
+
+def run_get_distributions(get_distributions, values, prefixes, weights):
+	get_distributions(values, prefixes, weights)
+
+
+def setup_track_stats(scale, seed):
+	from collections import Counter
+
+	tracks = generators.make_playlist_tracks(scale, seed)
+	track_counts = Counter(t["track"]["id"] for t in tracks if t["track"] and t["track"]["id"])
+
+	return (track_counts, *generators.make_track_data(list(track_counts), seed))
+
+
+def run_track_stats(track_counts, tracks_data, tracks_metadata):
+	from track_table import TrackTable
+
+	# the same steps get_stats_from_tracks takes once the requests are done
+	track_table = TrackTable(track_counts)
+	track_table.add_audio(tracks_data)
+	track_table.add_metadata(tracks_metadata)
+	track_table.get_distributions()
+
+
+def setup_get_entropy_from_ids_list(scale, seed):
+	import analyze_spotify_profiles
+
+	tracks = generators.make_playlist_tracks(scale, seed)
+	artist_ids = [t["track"]["artists"][0]["id"] for t in tracks if t["track"]]
+
+	return analyze_spotify_profiles.get_entropy_from_ids_list, artist_ids
+
+
+def run_get_entropy_from_ids_list(get_entropy_from_ids_list, ids):
+	get_entropy_from_ids_list(ids)
+
+
+def setup_track_entropies(scale, seed):
+	import analyze_spotify_profiles
+
+	return analyze_spotify_profiles, generators.make_playlist_tracks(scale, seed)
+
+
+def run_track_entropies(analyze_spotify_profiles, tracks):
+	analyze_spotify_profiles.get_entropies(tracks)
+
+
+def get_correlations_setup(method_name):
+	# setup for get_correlations with one of scipy's correlation functions
+	def setup(scale, seed):
+		from scipy import stats
+		import analyze_correlations
+
+		return (analyze_correlations.get_correlations, *generators.make_feature_tables(scale, seed=seed), getattr(stats, method_name))
+
+	return setup
+
+
+def run_get_correlations(get_correlations, df_messages, df_music, method):
+	get_correlations(df_messages, df_music, method)
+
+
+# every benchmark with what it builds before it's timed and what gets timed
+# max_scale leaves out sizes that would take too long to be worth timing
+# peak_rss also measures how much memory one run takes, in a fresh process
+BENCHMARKS = [
+	{"name": "analyze_user", "setup": setup_analyze_user, "run": run_analyze_user, "max_scale": 100000},
+	{"name": "analyze_user_per_message", "setup": setup_analyze_user, "run": run_analyze_user_per_message, "max_scale": 1000},
+	{"name": "batched_message_features", "setup": setup_analyze_user, "run": run_batched_message_features, "max_scale": 100000},
+	{"name": "per_message_features", "setup": setup_analyze_user, "run": run_per_message_features, "max_scale": 1000},
+	{"name": "load_users", "setup": setup_users_file, "run": run_load_users, "peak_rss": True},
+	{"name": "stream_users", "setup": setup_users_file, "run": run_stream_users, "peak_rss": True},
+	{"name": "get_distributions", "setup": setup_get_distributions, "run": run_get_distributions},
+	{"name": "track_stats", "setup": setup_track_stats, "run": run_track_stats},
+	{"name": "get_entropy_from_ids_list", "setup": setup_get_entropy_from_ids_list, "run": run_get_entropy_from_ids_list},
+	{"name": "track_entropies", "setup": setup_track_entropies, "run": run_track_entropies},
+	{"name": "pearson_correlations", "setup": get_correlations_setup("pearsonr"), "run": run_get_correlations},
+	{"name": "spearman_correlations", "setup": get_correlations_setup("spearmanr"), "run": run_get_correlations},
+	{"name": "kendall_correlations", "setup": get_correlations_setup("kendalltau"), "run": run_get_correlations}
+]
+
+
+def main():
+	names = {name.strip() for name in BENCHMARK_NAMES.split(",") if name.strip()}
+	unknown = names - {benchmark["name"] for benchmark in BENCHMARKS}
+
+	if unknown:
+		raise ValueError(f"Unknown benchmarks {', '.join(sorted(unknown))}, expected some of {', '.join(benchmark['name'] for benchmark in BENCHMARKS)}")
+
+	# loaded first, since it might be the file this run saves to
+	baseline = load_results(BENCHMARK_BASELINE) if BENCHMARK_BASELINE else None
+
+	results = []
+
+	for benchmark in BENCHMARKS:
+		if names and benchmark["name"] not in names:
+			continue
+
+		for scale in BENCHMARK_SCALES:
+			if scale > benchmark.get("max_scale", scale):
+				print(f"{benchmark['name']} at {scale}: skipped, over {benchmark['max_scale']}")
+				continue
+
+			result = run_benchmark(benchmark, scale)
+			results.append(result)
+
+			if "error" in result:
+				print(f"{benchmark['name']} at {scale}: failed with {result['error']}")
+			else:
+				memory = f", peak RSS {result['peak_rss_mb']:.0f} MB ({result['run_rss_mb']:.0f} MB during the run)" if "peak_rss_mb" in result else ""
+				print(f"{benchmark['name']} at {scale}: median {result['median_seconds']:.4f}s, {result['items_per_second']:.0f} items/s{memory}")
+
+	run_info = get_run_info()
+	path = save_results(run_info, results)
+	print(f"Benchmark results saved to {path}")
+
+	if baseline is not None:
+		print_comparison(baseline, results)
+
+
+def run_benchmark(benchmark, scale):
+	result = {"name": benchmark["name"], "scale": scale}
+
+	try:
+		# synthetic data is built before timing starts
+		args = benchmark["setup"](scale, BENCHMARK_SEED)
+		times = []
+
+		for _ in range(BENCHMARK_REPEATS):
+			# garbage from the last run isn't collected while this one is timed
+			gc.collect()
+			gc.disable()
+
+			try:
+				start = time.perf_counter()
+				benchmark["run"](*args)
+				times.append(time.perf_counter() - start)
+			finally:
+				gc.enable()
+
+		if benchmark.get("peak_rss"):
+			start_rss, peak_rss = get_peak_rss(benchmark["run"], args)
+			result |= {"peak_rss_mb": peak_rss, "run_rss_mb": peak_rss - start_rss}
+	except Exception as e:
+		# a benchmark that can't run here (like a missing nlp model) doesn't stop the others
+		result["error"] = f"{type(e).__name__}: {' '.join(str(e).split())}"
+		return result
+
+	median = float(np.median(times))
+
+	result |= {
+		"repeats": len(times),
+		"seconds": times,
+		"min_seconds": min(times),
+		"median_seconds": median,
+		"mean_seconds": float(np.mean(times)),
+		"items_per_second": scale / median if median > 0 else None
+	}
+
+	return result
+
+
+def get_peak_rss(run, args):
+	# a process's peak memory never goes back down, so it's measured on one more run in a new process
+	with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+		return executor.submit(measure_peak_rss, run, args).result()
+
+
+def measure_peak_rss(run, args):
+	# peak memory of this process before and after the run, in MB
+	start_rss = get_max_rss()
+	run(*args)
+
+	return start_rss, get_max_rss()
+
+
+def get_max_rss():
+	# linux carries ru_maxrss over to the new process, so it would start at this one's peak
+	# VmHWM starts over with every new program, so it's used when it's there
+	try:
+		with open("/proc/self/status", "r", encoding="utf-8") as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1]) / 1024
+	except OSError:
+		pass
+
+	import resource
+
+	# macos gives bytes
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20)
+
+
+def get_run_info():
+	# what the results were measured on, so runs on different commits and machines can be told apart
+	commit = get_git_output("rev-parse", "HEAD") or "unknown"
+	dirty = bool(get_git_output("status", "--porcelain", "--untracked-files=no"))
+
+	return {
+		"commit": commit,
+		"dirty": dirty,
+		"time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+		"seed": BENCHMARK_SEED,
+		"repeats": BENCHMARK_REPEATS,
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"platform": platform.platform(),
+		"processor": platform.processor() or platform.machine(),
+		"cpu_count": os.cpu_count()
+	}
+
+
+def get_git_output(*args):
+	try:
+		return subprocess.run(["git", *args], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return ""
+
+
+def save_results(run_info, results):
+	os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+
+	# uncommitted changes get their own file so they don't replace the commit's results
+	name = run_info["commit"][:12] + ("-dirty" if run_info["dirty"] else "")
+	path = os.path.join(BENCHMARK_RESULTS_DIR, f"{name}.json")
+
+	# results of benchmarks this run left out are kept from the last run on the same commit
+	if os.path.exists(path):
+		ran = {(result["name"], result["scale"]) for result in results}
+		results = [result for result in load_results(path)["results"] if (result["name"], result["scale"]) not in ran] + results
+
+	with open(path, "w", encoding="utf-8") as f:
+		json.dump({"run": run_info, "results": results}, f, indent=2)
+
+	return path
+
+
+def load_results(path):
+	with open(path, "r", encoding="utf-8") as f:
+		return json.load(f)
+
+
+def print_comparison(baseline, results):
+	baseline_results = {(result["name"], result["scale"]): result for result in baseline["results"] if "error" not in result}
+
+	print(f"\nCompared to {baseline['run']['commit'][:12]} (median seconds, above 1x is faster now)")
+	print(f"{'Benchmark':<28} {'Scale':>9} {'Before':>10} {'After':>10} {'Speedup':>8}")
+
+	for result in results:
+		before = baseline_results.get((result["name"], result["scale"]))
+
+		if before is None or "error" in result:
+			continue
+
+		speedup = before["median_seconds"] / result["median_seconds"]
+		memory = f"  peak RSS {before['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB" if "peak_rss_mb" in before and "peak_rss_mb" in result else ""
+		print(f"{result['name']:<28} {result['scale']:>9} {before['median_seconds']:>10.4f} {result['median_seconds']:>10.4f} {speedup:>7.2f}x{memory}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+import time
+from dotenv import load_dotenv
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the scripts are imported from the scripts folder, after the env variables below are set
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts"))
+
+import fake_apis
+import fake_discord
+
+# runs the data collection scripts end to end against fake_apis.py and fake_discord.py, and times each one
+# the scripts' own env variables (like SPOTIFY_WORKERS or SCRAPE_CONCURRENCY) work as usual, so runs with different settings can be compared
+# analyze_messages isn't included since it only reads the users table, run_benchmarks.py times it
+
+# load env variables
+load_dotenv()
+
+# folder the scripts run in, their data folder ends up here (empty makes a new temporary folder)
+FAKES_DIR = os.getenv("FAKES_DIR", "")
+
+# comma separated scripts to run, in this order
+FAKES_SCRIPTS = os.getenv("FAKES_SCRIPTS", "get_server_sample,get_user_sample,analyze_spotify_profiles")
+
+# how many fake discord servers get scraped, and how long each message can take to come back
+FAKE_DISCORD_SERVERS = int(os.getenv("FAKE_DISCORD_SERVERS", "3"))
+FAKE_DISCORD_MESSAGE_DELAY = float(os.getenv("FAKE_DISCORD_MESSAGE_DELAY", "0.001"))
+
+# settings the scripts need that only matter against the real services
+SCRIPT_DEFAULTS = {
+	"SERVER_CANDIDATE_POOL_SIZE": "500",
+	"SERVER_SAMPLE_SIZE": "10",
+	"CHANNEL_HISTORY_LIMIT": "150",
+	"USER_STRATUM_SIZE": "5",
+	"SPOTIFY_BATCH_SIZE": "100",
+	"SPOTIFY_ID": "fake",
+	"SPOTIFY_SECRET": "fake",
+	"DISCORD_TOKEN": "fake",
+	# the fake profiles don't need the careful default
+	"PROFILE_FETCH_RATE": "1000",
+	"PROFILE_FETCH_BURST": "100"
+}
+
+
+def main():
+	scripts = [name.strip() for name in FAKES_SCRIPTS.split(",") if name.strip()]
+	run_dir = FAKES_DIR or tempfile.mkdtemp(prefix="fakes-")
+
+	server = fake_apis.start_server()
+	port = server.server_address[1]
+
+	for name, value in (SCRIPT_DEFAULTS | fake_apis.get_urls(port)).items():
+		os.environ.setdefault(name, value)
+
+	fake_discord.guilds = [
+		fake_discord.make_guild(seed, delay=FAKE_DISCORD_MESSAGE_DELAY, spotify_users=fake_apis.FAKE_SPOTIFY_USERS)
+		for seed in range(FAKE_DISCORD_SERVERS)
+	]
+
+	# the scripts read and write data/ relative to where they run
+	os.makedirs(os.path.join(run_dir, "data"), exist_ok=True)
+	os.chdir(run_dir)
+	print(f"Running {', '.join(scripts)} in {run_dir} against the fake apis on port {port}")
+
+	times = {}
+
+	try:
+		for name in scripts:
+			script = __import__(name)
+
+			start = time.perf_counter()
+			script.main()
+			times[name] = time.perf_counter() - start
+	finally:
+		stats = server.apis.get_stats()
+		server.shutdown()
+
+	for name, seconds in times.items():
+		print(f"{name}: {seconds:.2f}s")
+
+	print(f"Fake apis: {stats['requests']} requests over {stats['connections']} connections")
+
+
+if __name__ == "__main__":
+	main()
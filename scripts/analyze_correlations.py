@@ -1,9 +1,13 @@
-import json
 import os
+import time
 import pandas as pd
 import numpy as np
 from scipy.stats import pearsonr, kendalltau, spearmanr
 from dotenv import load_dotenv
+from correlation_engine import get_correlation_matrix
+import instrumentation
+from instrumentation import timer
+from storage import read_columns
 
 # load env variables
 load_dotenv()
@@ -11,15 +15,20 @@ load_dotenv()
 # there has to be at least this many users with the property to calculate correlations with it
 MIN_PROPERTY_SAMPLE_SIZE = int(os.getenv("MIN_PROPERTY_SAMPLE_SIZE"))
 
-def main():
-	with open("data/messages_data.json", "r") as f:
-		message_data = json.load(f)
+# how many processes kendall pairs are split across
+CORRELATION_WORKERS = int(os.getenv("CORRELATION_WORKERS", "1"))
 
-	with open("data/spotify_data.json", "r") as f:
-		music_data = json.load(f)
+# methods that are calculated for all pairs at once by the correlation engine
+MATRIX_METHODS = {
+	pearsonr: "pearson",
+	spearmanr: "spearman",
+	kendalltau: "kendall"
+}
 
-	df_messages = pd.DataFrame(message_data)
-	df_music = pd.DataFrame(music_data)
+def main():
+	# every column is loaded since the merged csv has all of them, the correlations only use the numeric ones
+	df_messages = read_columns("messages_data")
+	df_music = read_columns("spotify_data")
 
 	# filter for numbers
 	messages_numeric_cols = df_messages.select_dtypes(include="number").columns
@@ -35,34 +44,32 @@ def main():
 	unidentifiable_data.to_csv("data/messages_and_spotify_data.csv", index=False)
 
 	# get correlation sand save as csvs
-	pearson_df = get_correlations(messages_numeric, music_numeric, pearsonr)
-	pearson_df.to_csv("data/pearson_correlations.csv", index=False)
+	for method, name in MATRIX_METHODS.items():
+		start = time.perf_counter()
 
-	spearman_df = get_correlations(messages_numeric, music_numeric, spearmanr)
-	spearman_df.to_csv("data/spearman_correlations.csv", index=False)
+		correlations_df = get_correlations(messages_numeric, music_numeric, method)
+		correlations_df.to_csv(f"data/{name}_correlations.csv", index=False)
 
-	kendall_df = get_correlations(messages_numeric, music_numeric, kendalltau)
-	kendall_df.to_csv("data/kendall_correlations.csv", index=False)
+		print(f"{name} correlations took {time.perf_counter() - start:.2f}s")
 
 	print("Correlations computed and saved to files")
 
 
 def get_correlations(df1, df2, method="pearson"):
+	# skip columns with constant values
+	columns1 = [col for col in df1.columns if df1[col].nunique() > 1]
+	columns2 = [col for col in df2.columns if df2[col].nunique() > 1]
+
+	if method in MATRIX_METHODS:
+		return get_matrix_correlations(df1[columns1], df2[columns2], method)
+
 	results = []
 
 	# loop through columns in first property
-	for col1 in df1.columns:
-
-		# skip columns with constant values
-		if df1[col1].nunique() <= 1:
-			continue
+	for col1 in columns1:
 
 		# loop through columns in second property
-		for col2 in df2.columns:
-			# skip columns with constant values
-			if df2[col2].nunique() <= 1:
-				continue
-
+		for col2 in columns2:
 			# drop NaN rows
 			valid_rows = df1[[col1]].join(df2[[col2]]).dropna()
 
@@ -73,7 +80,8 @@ def get_correlations(df1, df2, method="pearson"):
 			print(f"comparing {col1} with {col2} using {method.__name__}")
 	
 			# calculate correlation and significance
-			correlation, p_value = method(valid_rows[col1], valid_rows[col2])
+			with timer(f"{method.__name__}_pair", len(valid_rows)):
+				correlation, p_value = method(valid_rows[col1], valid_rows[col2])
 
 			results.append({
 				"message_metric": col1,
@@ -85,5 +93,37 @@ def get_correlations(df1, df2, method="pearson"):
 	return pd.DataFrame(results)
 
 
+def get_matrix_correlations(df1, df2, method):
+	print(f"comparing {len(df1.columns)} message metrics with {len(df2.columns)} music metrics using {method.__name__}")
+
+	# calculate correlation and significance of every pair at once
+	with timer(f"{MATRIX_METHODS[method]}_correlation_matrix", len(df1.columns) * len(df2.columns)):
+		correlations, p_values, sample_sizes = get_correlation_matrix(
+			df1.to_numpy(dtype=np.float64),
+			df2.to_numpy(dtype=np.float64),
+			MATRIX_METHODS[method],
+			MIN_PROPERTY_SAMPLE_SIZE,
+			CORRELATION_WORKERS
+		)
+
+	results = []
+
+	# same rows in the same order as comparing each pair
+	for i, col1 in enumerate(df1.columns):
+		for j, col2 in enumerate(df2.columns):
+			if sample_sizes[i, j] < MIN_PROPERTY_SAMPLE_SIZE:
+				# skip pairs with small sample size
+				continue
+
+			results.append({
+				"message_metric": col1,
+				"music_metric": col2,
+				"correlation": correlations[i, j],
+				"p_value": p_values[i, j]
+			})
+
+	return pd.DataFrame(results)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    instrumentation.run(main, "analyze_correlations")
\ No newline at end of file
@@ -1,4 +1,9 @@
+import hashlib
+import importlib.metadata
 import json
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
 import numpy as np
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 import textstat
@@ -6,39 +11,191 @@ from profanity_check import predict_prob as predict_profanity_prob
 from textblob import TextBlob
 from collections import Counter
 import pandas as pd
+from dotenv import load_dotenv
+from distribution_stats import get_distributions
+import instrumentation
+from instrumentation import count, timed, timer
+from sqlite_cache import SqliteCache
+from storage import iter_users, write_records
 
+# load env variables
+load_dotenv()
+
+# analyze all of a user's messages at once instead of one message at a time
+BATCH_MESSAGE_ANALYSIS = os.getenv("BATCH_MESSAGE_ANALYSIS", "1") == "1"
+
+# how many processes analyze users in parallel (1 runs everything in this process)
+MESSAGE_ANALYSIS_WORKERS = int(os.getenv("MESSAGE_ANALYSIS_WORKERS", "1"))
+
+# how many users are sent to a worker process at a time
+MESSAGE_ANALYSIS_CHUNK_SIZE = int(os.getenv("MESSAGE_ANALYSIS_CHUNK_SIZE", "4"))
+
+# where per-user results are cached between runs (empty disables the cache)
+MESSAGE_CACHE_PATH = os.getenv("MESSAGE_CACHE_PATH", "data/messages_cache.sqlite")
+
+# bump this whenever a change here changes analyze_user results so old cache entries aren't used
+MESSAGE_ANALYSIS_VERSION = 1
+
+# how many distinct messages keep their features in memory to be reused across users
+MESSAGE_MEMO_SIZE = int(os.getenv("MESSAGE_MEMO_SIZE", "100000"))
+
+# the analyzer and the profanity model are loaded once per process on import
+# so worker processes load them once and reuse them for every user they get
 vaderSentimentAnalyzer = SentimentIntensityAnalyzer()
 
+# features of recently seen messages, oldest first
+# each process has its own, so workers share it across the users they get
+message_memo = OrderedDict()
+
 def main():
 	message_data = []
 
-	# TODO: use csv instead of json
-	with open("data/users.json", "r") as file:
-		servers = json.load(file)
+	# stream users from the file one at a time
+	users = ((id, user["messages"]) for _, _, id, user in iter_users())
+
+	for id, user_data in analyze_users(users):
+		# TODO: don't use id bc thats identifiable
+		user_data["id"] = id
+
+		message_data.append(user_data)
+
+	# save data in the configured format
+	write_records("messages_data", message_data)
+
+
+def analyze_users(users):
+	cache = SqliteCache(MESSAGE_CACHE_PATH, "user_stats") if MESSAGE_CACHE_PATH else None
+	analyzer_versions = get_analyzer_versions()
+
+	# fan users out over worker processes, or analyze them in this process with 1 worker
+	executor = ProcessPoolExecutor(max_workers=MESSAGE_ANALYSIS_WORKERS) if MESSAGE_ANALYSIS_WORKERS > 1 else None
+
+	# total messages analyzed and how many of them actually had to be computed
+	memo_counts = [0, 0]
+
+	try:
+		pending = deque()
+
+		for chunk in iter_chunks(users, MESSAGE_ANALYSIS_CHUNK_SIZE):
+			pending.append(submit_chunk(executor, cache, analyzer_versions, chunk))
+
+			# only a few chunks are in flight at a time so users keep streaming from the file
+			if len(pending) >= max(MESSAGE_ANALYSIS_WORKERS, 1) * 2:
+				yield from collect_chunk(cache, memo_counts, *pending.popleft())
+
+		# results are collected in submission order, so output matches the serial run
+		while pending:
+			yield from collect_chunk(cache, memo_counts, *pending.popleft())
+	finally:
+		if executor is not None:
+			executor.shutdown()
+
+		message_count, computed_count = memo_counts
+		if computed_count > 0:
+			print(f"Analyzed {message_count} messages by computing {computed_count} distinct ones, dedup ratio: {message_count / computed_count:.2f}")
+
+		if cache is not None:
+			print(f"Message cache hits: {cache.hits}, misses: {cache.misses}")
+			cache.close()
+
+
+def iter_chunks(items, size):
+	chunk = []
+
+	for item in items:
+		chunk.append(item)
+
+		if len(chunk) >= size:
+			yield chunk
+			chunk = []
+
+	if chunk:
+		yield chunk
+
+
+def submit_chunk(executor, cache, analyzer_versions, chunk):
+	ids = [id for id, _ in chunk]
+	keys = [get_messages_key(messages, analyzer_versions) for _, messages in chunk] if cache is not None else [None] * len(chunk)
+
+	# only analyze users that aren't already cached
+	cached = cache.get_many(keys) if cache is not None else {}
+	missing = [(id, messages) for (id, messages), key in zip(chunk, keys) if key not in cached]
+
+	if executor is None:
+		future = Future()
+		future.set_result(analyze_user_chunk(missing))
+	else:
+		future = executor.submit(analyze_user_chunk, missing)
+
+	return ids, keys, cached, future
+
+
+def analyze_user_chunk(users):
+	results = []
+	memo_counts = [0, 0]
+
+	for id, messages in users:
+		print("getting data from user " + id)
+		results.append(analyze_user(messages, memo_counts))
+
+	# counts and timings are sent back with the results since workers can't update the main process
+	return results, memo_counts, instrumentation.take_records()
+
+
+def collect_chunk(cache, memo_counts, ids, keys, cached, future):
+	chunk_results, chunk_memo_counts, chunk_records = future.result()
+	results = iter(chunk_results)
+	new_entries = {}
 
-		for server in servers:
-			# go through both spotify and non spotify users
-			users = server["spotify_sample"] | server["non_spotify_sample"]
+	memo_counts[0] += chunk_memo_counts[0]
+	memo_counts[1] += chunk_memo_counts[1]
+	instrumentation.merge_records(chunk_records)
 
-			for id, user in users.items():
-				print("getting data from user " + id)
-				messages = user["messages"]
-				user_data = analyze_user(messages)
+	for id, key in zip(ids, keys):
+		if key in cached:
+			print("using cached data for user " + id)
+			yield id, dict(cached[key])
+		else:
+			user_data = next(results)
 
-				# TODO: don't use id bc thats identifiable
-				user_data["id"] = id
+			if key is not None:
+				new_entries[key] = dict(user_data)
 
-				message_data.append(user_data)
+			yield id, user_data
 
-	# save data to json
-	# TODO: use csv instead of json
-	with open("data/messages_data.json", "w", encoding="utf-8") as f:
-		json.dump(message_data, f, ensure_ascii=False, indent=2)
+	if new_entries:
+		cache.set_many(new_entries)
 
 
-def analyze_user(messages):
-	# analyze_message on every message
-	message_data = [analyze_message(msg) for msg in messages]
+def get_messages_key(messages, analyzer_versions):
+	# hash of the messages and everything that affects how they're analyzed
+	content = json.dumps(messages, ensure_ascii=False).encode("utf-8", "surrogatepass")
+	return hashlib.sha256(analyzer_versions.encode("utf-8") + b"\0" + content).hexdigest()
+
+
+def get_analyzer_versions():
+	versions = [f"analysis=={MESSAGE_ANALYSIS_VERSION}"]
+
+	for package in ("vaderSentiment", "textstat", "textblob", "alt-profanity-check"):
+		try:
+			versions.append(f"{package}=={importlib.metadata.version(package)}")
+		except importlib.metadata.PackageNotFoundError:
+			versions.append(f"{package}==unknown")
+
+	return ";".join(versions)
+
+
+@timed(items_arg=0)
+def analyze_user(messages, memo_counts=None):
+	# features are only computed once for each distinct message
+	features, computed_count = get_message_features(messages)
+
+	# repeat them for every copy of a message so the statistics see the original multiplicities
+	message_data = [features[msg] for msg in messages]
+
+	if memo_counts is not None:
+		memo_counts[0] += len(messages)
+		memo_counts[1] += computed_count
 
 	df = pd.DataFrame(message_data)
 
@@ -47,23 +204,48 @@ def analyze_user(messages):
 		"message_count": len(messages)
 	}
 	
-	for col_name, col in df.items():
-		if pd.api.types.is_numeric_dtype(col):
-			stats[col_name + "_q1"] = float(col.quantile(0.25))
-			stats[col_name + "_median"] = float(col.median())
-			stats[col_name + "_q3"] = float(col.quantile(0.75))
-			stats[col_name + "_range"] = float(col.max() - col.min())
-			stats[col_name + "_iqr"] = float(col.quantile(0.75) - col.quantile(0.25))
-			stats[col_name + "_std_dev"] = float(col.std()) if not np.isnan(col.std()) else None
-			stats[col_name + "_min"] = float(col.min())
-			stats[col_name + "_max"] = float(col.max())
-			stats[col_name + "_mean"] = float(col.mean())
-			stats[col_name + "_skewness"] = float(col.skew()) if not np.isnan(col.skew()) else None
+	# get every statistic for every numeric column at once
+	numeric_columns = [col_name for col_name, col in df.items() if pd.api.types.is_numeric_dtype(col)]
+	stats |= get_distributions(df[numeric_columns].to_numpy(dtype=np.float64).T, numeric_columns)
 
 	return stats
 
 
+def get_message_features(messages):
+	features = {}
+	missing = []
+
+	# reuse features of messages that were already seen
+	for msg in dict.fromkeys(messages):
+		if msg in message_memo:
+			message_memo.move_to_end(msg)
+			features[msg] = message_memo[msg]
+		else:
+			missing.append(msg)
+
+	if BATCH_MESSAGE_ANALYSIS:
+		# hand the whole message list to each analyzer
+		missing_data = analyze_message_batch(missing)
+	else:
+		# analyze_message on every message
+		missing_data = [analyze_message(msg) for msg in missing]
+
+	for msg, data in zip(missing, missing_data):
+		features[msg] = data
+		message_memo[msg] = data
+
+	count("message_memo_hits", len(features) - len(missing))
+	count("message_memo_misses", len(missing))
+
+	# forget the least recently used messages
+	while len(message_memo) > MESSAGE_MEMO_SIZE:
+		message_memo.popitem(last=False)
+
+	return features, len(missing)
+
+
 # TODO: add discord specific metrics like custom emojis, mentions, attachments, and links
+@timed()
 def analyze_message(message):
 	data = {}
 	
@@ -79,6 +261,40 @@ def analyze_message(message):
 	return data
 
 
+@timed(items_arg=0)
+def analyze_message_batch(messages):
+	# skip users without messages
+	if not messages:
+		return []
+
+	# one profanity model call and one character scan for the whole list
+	with timer("predict_profanity_prob", len(messages)):
+		profanity_probabilities = predict_profanity_prob(messages)
+
+	uppercase_ratios, alpha_ratios, ascii_ratios = get_character_ratios(messages)
+
+	message_data = []
+
+	# the rest of the analyzers only work on one string at a time
+	# textstat caches its own tokenization per string, so its nine passes share it
+	for i, message in enumerate(messages):
+		data = {}
+
+		data |= get_polarity_scores(message)
+		data |= get_textstat_data(message)
+		data |= get_textblob_data(message)
+
+		data["profanity_probability"] = profanity_probabilities[i]
+		data["uppercase_ratio"] = float(uppercase_ratios[i])
+		data["alpha_ratio"] = float(alpha_ratios[i])
+		data["ascii_ratio"] = float(ascii_ratios[i])
+
+		message_data.append(data)
+
+	return message_data
+
+
+@timed()
 def get_polarity_scores(message):
 	polarity_scores = vaderSentimentAnalyzer.polarity_scores(message)
 
@@ -91,6 +307,7 @@ def get_polarity_scores(message):
 	}
 
 
+@timed()
 def get_textstat_data(message):
 	word_count = textstat.lexicon_count(message, removepunct=True)
 
@@ -153,6 +370,43 @@ def get_ascii_ratio(message):
 	return  len(ascii) / len(message)
 
 
+@timed(items_arg=0)
+def get_character_ratios(messages):
+	# concatenate all messages into one buffer of code points
+	buffer = "".join(messages)
+	codes = np.frombuffer(buffer.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+	# classify each distinct character once, then map back onto the buffer
+	unique_codes, inverse = np.unique(codes, return_inverse=True)
+	unique_chars = [chr(code) for code in unique_codes]
+
+	is_alpha = np.array([c.isalpha() for c in unique_chars], dtype=bool)[inverse]
+	is_upper = np.array([c.isalpha() and c.isupper() for c in unique_chars], dtype=bool)[inverse]
+	is_ascii = (unique_codes < 128)[inverse]
+
+	# find where each message starts and ends in the buffer
+	lengths = np.fromiter((len(m) for m in messages), dtype=np.int64, count=len(messages))
+	ends = np.cumsum(lengths)
+	starts = ends - lengths
+
+	def count_per_message(flags):
+		cumulative = np.concatenate(([0], np.cumsum(flags, dtype=np.int64)))
+		return cumulative[ends] - cumulative[starts]
+
+	letter_counts = count_per_message(is_alpha)
+	upper_counts = count_per_message(is_upper)
+	ascii_counts = count_per_message(is_ascii)
+
+	# same rules as the single message versions, ratios are 0 when there is nothing to count
+	with np.errstate(divide="ignore", invalid="ignore"):
+		uppercase_ratios = np.where(letter_counts > 0, upper_counts / letter_counts, 0.0)
+		alpha_ratios = np.where(letter_counts > 0, letter_counts / lengths, 0.0)
+		ascii_ratios = np.where(ascii_counts > 0, ascii_counts / lengths, 0.0)
+
+	return uppercase_ratios, alpha_ratios, ascii_ratios
+
+
+@timed()
 def get_textblob_data(message):
 
 	message_blob = TextBlob(message)
@@ -178,4 +432,4 @@ def get_textblob_data(message):
 	return data
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    instrumentation.run(main, "analyze_messages")
\ No newline at end of file
@@ -1,15 +1,22 @@
-import json
 import os
 import sys
-import time
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
-import requests
 import pandas as pd
 import numpy as np
 from scipy.stats import entropy as scipy_entropy
+from distribution_stats import get_distributions
+from http_client import HttpSession, HTTP_POOL_SIZE
+import instrumentation
+from instrumentation import count, timed, timer
+from rate_limiter import ThreadTokenBucket
+from sqlite_cache import SqliteCache
+from storage import iter_users, read_records, table_exists, write_records
+from track_table import TrackTable
 
 # load env variables
 load_dotenv()
@@ -19,77 +26,208 @@ SPOTIFY_SECRET = os.getenv("SPOTIFY_SECRET")
 SPOTIFY_PROFILE = os.getenv("SPOTIFY_PROFILE")
 SPOTIFY_BATCH_SIZE = int(os.getenv("SPOTIFY_BATCH_SIZE"))
 
+# how many users are fetched at the same time, and how many requests each of those can have going at once
+SPOTIFY_WORKERS = int(os.getenv("SPOTIFY_WORKERS", "1"))
+
+# requests per second to spotify and reccobeats combined, and how many can go at once after being idle
+# empty doesn't limit them, the retries still wait out rate limits from the servers
+SPOTIFY_REQUEST_RATE = os.getenv("SPOTIFY_REQUEST_RATE", "")
+SPOTIFY_REQUEST_BURST = int(os.getenv("SPOTIFY_REQUEST_BURST", "10"))
+
+# endpoints can be pointed at a local mock for testing
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "")
+SPOTIFY_TOKEN_URL = os.getenv("SPOTIFY_TOKEN_URL", "")
+RECCOBEATS_URL = os.getenv("RECCOBEATS_URL", "https://api.reccobeats.com/v1/audio-features")
+
+# where audio features and metadata of tracks are cached across users and runs (empty disables the cache)
+TRACK_CACHE_PATH = os.getenv("TRACK_CACHE_PATH", "data/tracks_cache.sqlite")
+
+# how many days a cached track is used before it's fetched again, and how many tracks are kept (0 keeps all)
+TRACK_CACHE_TTL_DAYS = float(os.getenv("TRACK_CACHE_TTL_DAYS", "30"))
+TRACK_CACHE_MAX_ENTRIES = int(os.getenv("TRACK_CACHE_MAX_ENTRIES", "1000000"))
+
+# every request waits for its turn here, whatever thread it's from
+request_budget = ThreadTokenBucket(float(SPOTIFY_REQUEST_RATE), SPOTIFY_REQUEST_BURST) if SPOTIFY_REQUEST_RATE else None
+
+# spotify and reccobeats requests share these connections, retries and the request budget
+# every thread can have a request going at once
+http_session = HttpSession(rate_limiter=request_budget, pool_size=max(HTTP_POOL_SIZE, SPOTIFY_WORKERS * 2))
+
 def main():
-	spotifyApi = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
+	auth_manager = SpotifyClientCredentials(
 		client_id=SPOTIFY_ID,
 		client_secret=SPOTIFY_SECRET,
-	))
+	)
+
+	if SPOTIFY_TOKEN_URL:
+		auth_manager.OAUTH_TOKEN_URL = SPOTIFY_TOKEN_URL
+
+	spotifyApi = spotipy.Spotify(auth_manager=auth_manager, requests_session=http_session)
+
+	if SPOTIFY_API_URL:
+		spotifyApi.prefix = SPOTIFY_API_URL
+
+	# one table for each source, shared by every user
+	track_caches = open_track_caches()
 
 	spotify_data = []
 	fetched_users = 0
 
 	# load spotify data from file to pick up where previously left off
-	if os.path.exists("data/spotify_data.json"):
-		with open("data/spotify_data.json", "r") as progress_file:
-			spotify_data = json.load(progress_file)
+	if table_exists("spotify_data"):
+		spotify_data = read_records("spotify_data")
 
 	# keep track if ids we already checked
 	processed_ids = {entry["id"] for entry in spotify_data}
 
-	with open("data/users.json", "r") as users_file:
-		servers = json.load(users_file)
+	# non spotify users are processed quickly on-device, so they're only saved once a run of them is done
+	unsaved_users = False
 
-		for server in servers:
-			spotify_users = server["spotify_sample"]
-			for id, user in spotify_users.items():
+	# users are fetched in one pool, and their playlists, pages and track batches in another
+	# so a user never waits on a pool that's full of users waiting on it
+	user_executor = ThreadPoolExecutor(max_workers=SPOTIFY_WORKERS) if SPOTIFY_WORKERS > 1 else None
+	page_executor = ThreadPoolExecutor(max_workers=SPOTIFY_WORKERS) if SPOTIFY_WORKERS > 1 else None
 
-				# check if already loaded from progress file
-				if id in processed_ids:
-					continue
+	# users in the order they're read, with the data of spotify users on the way
+	pending_users = deque()
+	queued_users = 0
 
-				print("getting data from user " + id)
+	try:
+		# stream users from the file one at a time
+		for _, stratum, id, user in iter_users():
+			# check if already loaded from progress file
+			if id in processed_ids:
+				continue
 
+			if stratum == "spotify_sample":
 				# get data from profile url
-				spotify_url = user["spotifyUrl"]
-				user_data = get_user_data(spotifyApi, spotify_url)
-
-				# TODO: don't use id bc thats identifiable
-				user_data["has_spotify"] = 1
-				user_data["id"] = id
-
-				spotify_data.append(user_data)
+				if user_executor is None:
+					user_data = run_now(get_user_data, spotifyApi, user["spotifyUrl"], id, page_executor, track_caches)
+				else:
+					user_data = user_executor.submit(get_user_data, spotifyApi, user["spotifyUrl"], id, page_executor, track_caches)
+			else:
+				user_data = None
 
-				# save data after every spotify user to make sure data isn't lost with errors
-				save_spotify_data(spotify_data)
+			pending_users.append((id, user_data))
+			queued_users += 1
 
+			# keep a couple of users per worker on the way
+			while len(pending_users) > SPOTIFY_WORKERS * 2 or (pending_users and queued_users >= SPOTIFY_BATCH_SIZE):
+				unsaved_users = save_next_user(spotify_data, pending_users, unsaved_users)
 				fetched_users += 1
 				check_batch_completion(fetched_users)
-			
-			# non spotify users
-			non_spotify_users = server["non_spotify_sample"]
-			
-			for id, user in non_spotify_users.items():
-				# check if already loaded from progress file
-				if id in processed_ids:
-					continue
-
-				spotify_data.append({
-				# TODO: don't use id bc thats identifiable
-					"has_spotify": 0,
-					"id": id
-				})
 
-				fetched_users += 1
-				check_batch_completion(fetched_users)
+		while pending_users:
+			unsaved_users = save_next_user(spotify_data, pending_users, unsaved_users)
+			fetched_users += 1
+			check_batch_completion(fetched_users)
+	finally:
+		for executor in (user_executor, page_executor):
+			if executor is not None:
+				executor.shutdown(cancel_futures=True)
+
+		for table, cache in track_caches.items():
+			print(f"Track cache {table} hits: {cache.hits}, misses: {cache.misses}")
+			cache.close()
+
+		if request_budget is not None:
+			print(f"Request budget: {request_budget.get_report()}")
+		print(http_session.get_report())
+
+	if unsaved_users:
+		save_spotify_data(spotify_data)
+
+
+def save_next_user(spotify_data, pending_users, unsaved_users):
+	# returns whether there are users that haven't been saved yet
+	id, user_data = pending_users.popleft()
+
+	if user_data is not None:
+		try:
+			user_data = user_data.result()
+		except (requests.RequestException, spotipy.SpotifyException) as e:
+			# requests that ran out of retries skip the user instead of stopping the run
+			# they aren't saved, so they get picked up again on the next run
+			print(f"Skipping user {id}, fetching their data failed: {e}")
+			return unsaved_users
+
+		# TODO: don't use id bc thats identifiable
+		user_data["has_spotify"] = 1
+		user_data["id"] = id
+
+		spotify_data.append(user_data)
+
+		# save data after every spotify user to make sure data isn't lost with errors
+		save_spotify_data(spotify_data)
+		return False
+
+	# non spotify users
+	spotify_data.append({
+	# TODO: don't use id bc thats identifiable
+		"has_spotify": 0,
+		"id": id
+	})
+	return True
+
+
+def open_track_caches():
+	if not TRACK_CACHE_PATH:
+		return {}
+
+	os.makedirs(os.path.dirname(TRACK_CACHE_PATH) or ".", exist_ok=True)
+
+	return {
+		table: SqliteCache(TRACK_CACHE_PATH, table, ttl=TRACK_CACHE_TTL_DAYS * 24 * 60 * 60, max_entries=TRACK_CACHE_MAX_ENTRIES)
+		for table in ("audio_features", "track_metadata")
+	}
+
+
+def get_cached_tracks(cache, unique_track_ids, source):
+	# cached results of the tracks that have them, and the ids that still have to be fetched
+	if cache is None:
+		return {}, unique_track_ids
+
+	cached = cache.get_many(unique_track_ids)
+	missing_ids = [tid for tid in unique_track_ids if tid not in cached]
+
+	name = source.lower().replace(" ", "_")
+	count(f"{name}_cache_hits", len(cached))
+	count(f"{name}_cache_misses", len(missing_ids))
+
+	if unique_track_ids:
+		print(f"{source} cache: {len(cached)}/{len(unique_track_ids)} tracks cached ({len(cached) / len(unique_track_ids):.0%}), fetching {len(missing_ids)}")
+
+	return cached, missing_ids
+
+
+def run_now(function, *args):
+	# runs the function in this thread when there's no pool, with its result or error in a future like the pool gives back
+	future = Future()
+
+	try:
+		future.set_result(function(*args))
+	except Exception as e:
+		future.set_exception(e)
+
+	return future
+
+
+def map_requests(executor, function, items):
+	# run requests in the pool if there is one, results come back in the same order either way
+	if executor is None:
+		return [function(item) for item in items]
+
+	return list(executor.map(function, items))
+
 
-			# since non spotify users are processed quickly on-device, we can just save once after they're all done
-			save_spotify_data(spotify_data)
+def get_page_offsets(page):
+	# offsets of the pages after this one
+	return range(page["offset"] + page["limit"], page["total"], page["limit"])
 
 
 def save_spotify_data(spotify_data):
-	# save data to json
-	with open("data/spotify_data.json", "w", encoding="utf-8") as f:
-		json.dump(spotify_data, f, ensure_ascii=False, indent=2)
+	# save data in the configured format
+	write_records("spotify_data", spotify_data)
 
 
 def check_batch_completion(fetched_users):
@@ -99,20 +237,22 @@ def check_batch_completion(fetched_users):
 		sys.exit()
 
 
-def get_user_data(spotifyApi, profile_url):
+@timed()
+def get_user_data(spotifyApi, profile_url, id, executor=None, track_caches=None):
+	print("getting data from user " + id)
+
 	user_stats = {}
 
 	# get playlists
-	playlists = get_playlists(spotifyApi, profile_url)
+	playlists = get_playlists(spotifyApi, profile_url, executor)
+
+	# get tracks from every playlist
+	playlists_tracks = get_playlists_tracks(spotifyApi, playlists, executor)
 	playlist_lengths = []
 
 	# combine all tracks
 	all_tracks = []
-	for playlist in playlists:
-		# get tracks from playlist
-		print(f"Getting tracks from playlist {playlist['id']}")
-		playlist_tracks = get_playlist_tracks(spotifyApi, playlist)
-
+	for playlist_tracks in playlists_tracks:
 		# add to total tracks list
 		all_tracks.extend(playlist_tracks)
 
@@ -123,7 +263,7 @@ def get_user_data(spotifyApi, profile_url):
 	if len(all_tracks) > 0:
 		# get data from combined tracks list
 		print("Getting track stats")
-		user_stats = get_stats_from_tracks(spotifyApi, all_tracks)
+		user_stats = get_stats_from_tracks(spotifyApi, all_tracks, executor, track_caches)
 
 		# get data on playlist lengths
 		playlist_df = pd.DataFrame({"playlist_length": playlist_lengths})
@@ -136,138 +276,133 @@ def get_user_data(spotifyApi, profile_url):
 	return user_stats
 
 
-def get_playlists (spotifyApi, profile_url):
+@timed()
+def get_playlists (spotifyApi, profile_url, executor=None):
 	# get username from profile link
 	username = profile_url.rstrip("/").split("/")[-1]
 
 	# get first page of playlists
 	results = spotifyApi.user_playlists(username)
 
-	playlists = []
+	playlists = list(results["items"])
+
+	# get the rest of the pages
+	pages = map_requests(executor, lambda offset: spotifyApi.user_playlists(username, offset=offset), get_page_offsets(results))
+
+	for page in pages:
+		playlists.extend(page["items"])
 
-	# keep going through paginated playlist data
-	while results:
-		playlists.extend(results["items"])
-		results = spotifyApi.next(results) if results["next"] else None
-	
 	return playlists
 
 
-def get_playlist_tracks(spotifyApi, playlist):
-	# get playlist id
-	playlist_id = playlist["id"]
-	tracks = []
+@timed(items_arg=1)
+def get_playlists_tracks(spotifyApi, playlists, executor=None):
+	# first page of every playlist, then every other page of every playlist
+	first_pages = map_requests(executor, lambda playlist: get_first_tracks_page(spotifyApi, playlist), playlists)
 
-	# get all tracks with pagination from spotify
-	results = spotifyApi.playlist_tracks(playlist_id)
-	while results:
-		tracks.extend(results["items"])
-		results = spotifyApi.next(results) if results["next"] else None
+	# (playlist index, offset) of the other pages
+	other_pages = [(i, offset) for i, page in enumerate(first_pages) for offset in get_page_offsets(page)]
+	pages = map_requests(
+		executor,
+		lambda page: spotifyApi.playlist_tracks(playlists[page[0]]["id"], offset=page[1]),
+		other_pages
+	)
 
-	return tracks
+	playlists_tracks = [list(page["items"]) for page in first_pages]
 
+	for (i, _), page in zip(other_pages, pages):
+		playlists_tracks[i].extend(page["items"])
 
-def get_stats_from_tracks(spotifyApi, tracks):
-	# collect audio features for each track from reccobeats
-	track_ids = [t["track"]["id"] for t in tracks if t["track"]]
-	audio_features = get_audio_features_from_tracks(track_ids)
+	return playlists_tracks
 
-	# get more properties from spotify metadata
-	spotify_metadata = get_metadata_from_tracks(spotifyApi, track_ids)
-
-	# create data frames for audio features and metadata
-	audio_df = pd.DataFrame(audio_features)
-	meta_df = pd.DataFrame(spotify_metadata)
-
-	# merge all features on id
-	# it doesn't matter if spotify and reccobeats songs match bc all we need is summary statistics of each individual metric
-	all_features_df = pd.concat([audio_df.reset_index(drop=True), meta_df.reset_index(drop=True)], axis=1)
-
-	# properties to analyze
-	properties = [
-		"acousticness",
-		"danceability",
-		"energy",
-		"liveness",
-		"loudness",
-		"mode",
-		"speechiness",
-		"tempo",
-		"valence",
-		"popularity",
-		"duration_ms",
-		"explicit",
-		"release_year"
-	]	
-
-	# get distribution stats
-	tracks_stats = get_distribution_from_df(all_features_df, properties)
 
-	# include entropy stats
-	tracks_stats["artist_entropy"] = get_artist_entropy(tracks)
-	tracks_stats["album_entropy"] = get_album_entropy(tracks)
-	tracks_stats["track_entropy"] = get_track_entropy(tracks)
+def get_first_tracks_page(spotifyApi, playlist):
+	# get tracks from playlist
+	print(f"Getting tracks from playlist {playlist['id']}")
 
-	return tracks_stats
+	return spotifyApi.playlist_tracks(playlist["id"])
 
 
-def get_artist_entropy(tracks):
-	artist_ids = []
+@timed(items_arg=1)
+def get_stats_from_tracks(spotifyApi, tracks, executor=None, track_caches=None):
+	track_caches = track_caches or {}
 
-	# get albums from tracks
-	for t in tracks:
-		track = t.get("track")
+	# count duplicates
+	track_ids = [t["track"]["id"] for t in tracks if t["track"]]
+	track_counts = Counter([tid for tid in track_ids if isinstance(tid, str) and tid.strip()])
 
-		if track and track.get("artists"):
-			artist_ids.append(track["artists"][0].get("id"))
+	# one row per unique track, filled in by each source as its batches come back
+	track_table = TrackTable(track_counts)
 
-	# get entropy
-	artist_entropy = get_entropy_from_ids_list(artist_ids)
+	# collect audio features for each track from reccobeats
+	get_audio_features_from_tracks(track_table, executor, track_caches.get("audio_features"))
 
-	return artist_entropy
+	# get more properties from spotify metadata
+	get_metadata_from_tracks(spotifyApi, track_table, executor, track_caches.get("track_metadata"))
 
+	# get distribution stats, weighting each track by how many times it appears throughout all playlists
+	with timer("track_distributions", len(track_table.ids)):
+		tracks_stats = track_table.get_distributions()
 
-def get_album_entropy(tracks):
-	album_ids = []
+	# include entropy stats
+	tracks_stats |= get_entropies(tracks)
 
-	# get albums from tracks
-	for t in tracks:
-		track = t.get("track")
+	return tracks_stats
 
-		if track and track.get("album"):
-			album_ids.append(track["album"].get("id"))
 
-	# get entropy
-	album_entropy = get_entropy_from_ids_list(album_ids)
+@timed(items_arg=0)
+def get_entropies(tracks):
+	# normalized entropy of the artists, albums and tracks throughout all playlists
+	artist_codes, album_codes, track_codes = encode_track_ids(tracks)
 
-	return album_entropy
+	return {
+		"artist_entropy": get_entropy_from_codes(artist_codes),
+		"album_entropy": get_entropy_from_codes(album_codes),
+		"track_entropy": get_entropy_from_codes(track_codes)
+	}
 
 
-def get_track_entropy(tracks):
-	track_ids = []
+def encode_track_ids(tracks):
+	# the first artist, album and id of every track as integer codes, collected in one walk through the tracks
+	artist_ids, album_ids, track_ids = [], [], []
 
-	# get albums from tracks
 	for t in tracks:
 		track = t.get("track")
 
-		if track and track.get("id"):
-			track_ids.append(track["id"])
+		if not track:
+			continue
+
+		if track.get("artists"):
+			artist_ids.append(track["artists"][0].get("id"))
+
+		if track.get("album"):
+			album_ids.append(track["album"].get("id"))
 
-	# get entropy
-	track_entropy = get_entropy_from_ids_list(track_ids)
+		if track.get("id"):
+			track_ids.append(track["id"])
 
-	return track_entropy
+	return get_id_codes(artist_ids), get_id_codes(album_ids), get_id_codes(track_ids)
 
 
 def get_entropy_from_ids_list(ids):
-	ids_df = pd.DataFrame({"id": ids})
+	return get_entropy_from_codes(get_id_codes(ids))
+
+
+def get_id_codes(ids):
+	# each distinct id as a number from 0, with missing ids (removed tracks and local files) left out
+	lookup = {}
 
-	# get counts for each artist
-	counts = ids_df["id"].value_counts(normalize=True)  # normalize to get proportions
-	unique_instances = ids_df["id"].nunique()
+	return np.array([lookup.setdefault(id, len(lookup)) for id in ids if id is not None], dtype=np.int64)
 
-	# raw entropy
-	raw_entropy = scipy_entropy(counts)
+
+def get_entropy_from_codes(codes):
+	# how many times each id appears, most common first like pandas value_counts has them
+	# so the proportions and their sum come out exactly the same as they used to
+	counts = np.sort(np.bincount(codes))[::-1]
+	unique_instances = len(counts)
+
+	# raw entropy of the proportions
+	raw_entropy = scipy_entropy(counts / counts.sum())
 
 	# normalize
 	if unique_instances > 1:
@@ -278,131 +413,122 @@ def get_entropy_from_ids_list(ids):
 	return float(normalized_entropy)
 
 
-def get_audio_features_from_tracks(track_ids):
-	audio_features = []
+def get_audio_features_from_tracks(track_table, executor=None, cache=None):
+	# only tracks that aren't cached are fetched
+	track_features, missing_ids = get_cached_tracks(cache, track_table.ids, "Audio features")
 
-	# count duplicates
-	track_counts = Counter([tid for tid in track_ids if isinstance(tid, str) and tid.strip()])
-	unique_track_ids = list(track_counts.keys())
+	# batch in 40s
+	batches = range(0, len(missing_ids), 40)
+	results = map_requests(executor, lambda i: get_audio_features_batch(missing_ids, i), batches)
 
-	for i in range(0, len(unique_track_ids), 40):  # batch in 40s
-		# get string list of next 40 track ids
-		# for some reason they can be None sometimes? maybe local files
-		track_batch = [tid for tid in unique_track_ids[i:i+40] if tid is not None]
+	for fetched_features in results:
+		track_features |= fetched_features
 
-		ids_batch = ",".join(track_batch)
+		if cache is not None:
+			cache.set_many(fetched_features)
 
-		while True:
-			# get audio features
-			url = f"https://api.reccobeats.com/v1/audio-features?ids={ids_batch}"
-			response = requests.get(url)
+	# reccobeats doesn't have every track
+	track_table.add_audio({tid: tracks_data[0] for tid, tracks_data in track_features.items() if tracks_data})
 
-			print(f"Fetching audio data for tracks {i + 1}-{i + len(track_batch)}")
 
-			if response.status_code == 200:
-				data = response.json().get("content", [])
+def get_audio_features_batch(track_ids, i):
+	# returns the features reccobeats has for each of the next 40 tracks (often none)
+	# get string list of next 40 track ids
+	# for some reason they can be None sometimes? maybe local files
+	track_batch = [tid for tid in track_ids[i:i+40] if tid is not None]
 
-                # loop through tracks
-				for track_data in data:
-					# get spotify id from url (id field will be its reccobeats id)
-					spotify_id = track_data["href"].split("/")[-1]
-					
-                	# add the track as many times as it appears throughout all playlists
-					count = track_counts.get(spotify_id, 1)
-					audio_features.extend([track_data] * count)
+	ids_batch = ",".join(track_batch)
 
-				break  # exit retry loop if successful
+	# get audio features
+	# rate limits and server errors are retried by the session, and raise once it runs out of retries
+	# any other error raises too, so the user isn't saved without them and gets picked up again on the next run
+	url = f"{RECCOBEATS_URL}?ids={ids_batch}"
 
-			elif response.status_code == 429:
-				# handle rate limit
-				retry_after = int(response.headers.get("Retry-After", 4)) + 1  # default 5 sec and add an extra second in case
-				print(f"Rate limited, retrying after {retry_after} seconds")
-				time.sleep(retry_after)
+	with timer("reccobeats_request", len(track_batch)):
+		response = http_session.get(url)
 
-			else:
-				print(f"{url}")
-				print(f"Error fetching batch {i + 1}-{i+len(track_batch)}: {response.status_code}")
-				break  # exit retry loop on other errors
+	print(f"Fetching audio data for tracks {i + 1}-{i + len(track_batch)}")
 
-	return audio_features
+	response.raise_for_status()
 
+	data = response.json().get("content", [])
+	track_features = {tid: [] for tid in track_batch}
 
-def get_metadata_from_tracks(spotifyApi, track_ids):
-	spotify_metadata = []
+	# loop through tracks
+	for track_data in data:
+		# get spotify id from url (id field will be its reccobeats id)
+		spotify_id = track_data["href"].split("/")[-1]
 
-	# spotify API automatically handles duplicate tracks, so we don't technically need to do that like with reccobeats
-	# it saves time and reduces api calls tho
+		if spotify_id in track_features:
+			track_features[spotify_id].append(track_data)
 
-	# count duplicates
-	track_counts = Counter([tid for tid in track_ids if isinstance(tid, str) and tid.strip()])
-	unique_track_ids = list(track_counts.keys())
+	return track_features
 
-	for i in range(0, len(unique_track_ids), 50):
-    
-		track_batch = unique_track_ids[i:i+50]
 
-		print(f"Fetching metadata for tracks {i + 1}-{i + len(track_batch)}")
+def get_metadata_from_tracks(spotifyApi, track_table, executor=None, cache=None):
+	# spotify API automatically handles duplicate tracks, so we don't technically need to do that like with reccobeats
+	# it saves time and reduces api calls tho
 
-		# remove None or non strings
-		track_batch = [tid for tid in track_batch if isinstance(tid, str) and tid.strip()]
+	# only tracks that aren't cached are fetched
+	tracks_metadata, missing_ids = get_cached_tracks(cache, track_table.ids, "Metadata")
 
-		try:
-			results = spotifyApi.tracks(track_batch)
+	batches = range(0, len(missing_ids), 50)
+	results = map_requests(executor, lambda i: get_metadata_batch(spotifyApi, missing_ids, i), batches)
 
-			for track in results["tracks"]:
-				if track:
+	for fetched_metadata in results:
+		tracks_metadata |= fetched_metadata
 
-					release_year = int(track["album"]["release_date"][:4])
+		if cache is not None:
+			cache.set_many(fetched_metadata)
 
-					# fix invalid release years
-					# spotify sometimes reports them as 0 for some reason
-					release_year = None if release_year == 0 else release_year
+	# without the ones spotify didn't find
+	track_table.add_metadata({tid: track_metadata for tid, track_metadata in tracks_metadata.items() if track_metadata})
 
-					track_metadata = {
-						"id": track["id"],
-						"popularity": track["popularity"],
-						"explicit": int(track["explicit"]),  # treat as 0/1
-						"duration_ms": track["duration_ms"],
-						"release_year": int(track["album"]["release_date"][:4])
-					}
 
+def get_metadata_batch(spotifyApi, track_ids, i):
+	# returns the metadata of each of the next 50 tracks (None if spotify didn't find it)
+	track_batch = track_ids[i:i+50]
 
-					# duplicate by how many times this track appears throughout all playlists
-					count = track_counts.get(track["id"], 1)
-					spotify_metadata.extend([track_metadata] * count)
+	print(f"Fetching metadata for tracks {i + 1}-{i + len(track_batch)}")
 
+	# remove None or non strings
+	track_batch = [tid for tid in track_batch if isinstance(tid, str) and tid.strip()]
 
-		except Exception as e:
-			print(f"Error fetching metadata batch {i + 1}-{i+len(track_batch)}: {e}")
+	# request errors raise once the session runs out of retries, so the user is skipped and picked up again on the next run
+	with timer("spotify_tracks_request", len(track_batch)):
+		results = spotifyApi.tracks(track_batch)
 
-	return spotify_metadata
+	tracks_metadata = {}
 
+	for tid, track in zip(track_batch, results["tracks"]):
+		if track:
+			try:
+				release_year = int(track["album"]["release_date"][:4])
+			except (KeyError, TypeError, ValueError):
+				# a missing or unreadable release date only loses this track's year
+				print(f"Unreadable release date for track {tid}")
+				release_year = None
 
-def get_distribution_from_df(df, properties):
-	stats = {}
+			track = {
+				"id": track["id"],
+				"popularity": track["popularity"],
+				"explicit": int(track["explicit"]),  # treat as 0/1
+				"duration_ms": track["duration_ms"],
+				"release_year": release_year
+			}
 
-	# apply to each property
-	for prop in properties:
-		if prop in df.columns:
-			stats |= get_distribution_from_col(df[prop], prop)
+		tracks_metadata[tid] = track
 
-	return stats
+	return tracks_metadata
 
 
-def get_distribution_from_col(col, prefix):
-	return {
-		prefix + "_q1": float(col.quantile(0.25)),
-		prefix + "_median": float(col.median()),
-		prefix + "_q3": float(col.quantile(0.75)),
-		prefix + "_range": float(col.max() - col.min()),
-		prefix + "_iqr": float(col.quantile(0.75) - col.quantile(0.25)),
-		prefix + "_std_dev": float(col.std()) if not np.isnan(col.std()) else None,
-		prefix + "_min": float(col.min()),
-		prefix + "_max": float(col.max()),
-		prefix + "_mean": float(col.mean()),
-		prefix + "_skewness": float(col.skew()) if not np.isnan(col.skew()) else None
-	}
+def get_distribution_from_df(df, properties, weights=None):
+	# only use properties that are in the data frame
+	columns = [prop for prop in properties if prop in df.columns]
+
+	# get every statistic for every property at once
+	return get_distributions(df[columns].to_numpy(dtype=np.float64).T, columns, weights)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    instrumentation.run(main, "analyze_spotify_profiles")
\ No newline at end of file
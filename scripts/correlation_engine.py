@@ -0,0 +1,253 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import special
+from scipy.stats import kendalltau, norm, rankdata, t as t_distribution
+
+# correlations this many float steps away from 1 or -1 are rounding errors of a perfect correlation
+PERFECT_CORRELATION_ULPS = 4
+
+# kendall pairs sent to a worker process at a time are split into this many chunks per worker
+KENDALL_CHUNKS_PER_WORKER = 4
+
+
+def get_correlation_matrix(x, y, method, min_sample_size, workers=1):
+	# correlations, p values and sample sizes between every column of x and every column of y
+	# missing values are NaN, and each pair only uses the rows where both columns have values
+	# workers is how many processes kendall pairs are split across
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+
+	shape = (x.shape[1], y.shape[1])
+	correlations = np.full(shape, np.nan)
+	p_values = np.full(shape, np.nan)
+	sample_sizes = np.zeros(shape, dtype=np.int64)
+
+	executor = ProcessPoolExecutor(max_workers=workers) if method == "kendall" and workers > 1 else None
+
+	try:
+		# columns with the same missing rows share the same valid rows for every pair,
+		# so each group of pairs is computed at once over the rows they all have
+		for x_present, x_columns in get_missing_patterns(x):
+			for y_present, y_columns in get_missing_patterns(y):
+				rows = x_present & y_present
+				sample_size = int(rows.sum())
+
+				pairs = np.ix_(x_columns, y_columns)
+				sample_sizes[pairs] = sample_size
+
+				# skip pairs with small sample size (scipy needs at least 2 rows too)
+				if sample_size < max(min_sample_size, 2):
+					continue
+
+				x_values = x[np.ix_(rows, x_columns)]
+				y_values = y[np.ix_(rows, y_columns)]
+
+				if method == "pearson":
+					correlations[pairs], p_values[pairs] = get_pearson(x_values, y_values)
+				elif method == "spearman":
+					correlations[pairs], p_values[pairs] = get_spearman(x_values, y_values)
+				elif method == "kendall":
+					correlations[pairs], p_values[pairs] = get_kendall_parallel(executor, workers, x_values, y_values)
+				else:
+					raise ValueError(f"Unknown correlation method {method!r}")
+	finally:
+		if executor is not None:
+			executor.shutdown()
+
+	return correlations, p_values, sample_sizes
+
+
+def get_missing_patterns(values):
+	# group columns by which rows they have values in
+	present = ~np.isnan(values)
+	patterns = {}
+
+	for column in range(values.shape[1]):
+		patterns.setdefault(present[:, column].tobytes(), []).append(column)
+
+	return [(present[:, columns[0]], np.array(columns)) for columns in patterns.values()]
+
+
+def get_correlation_coefficients(x_values, y_values):
+	# pearson correlation between every column of x and every column of y
+	# columns that are constant within the rows have no correlation (NaN), like scipy
+	x_centered = x_values - x_values.mean(axis=0)
+	y_centered = y_values - y_values.mean(axis=0)
+
+	with np.errstate(invalid="ignore", divide="ignore"):
+		x_normalized = x_centered / np.linalg.norm(x_centered, axis=0)
+		y_normalized = y_centered / np.linalg.norm(y_centered, axis=0)
+
+	correlations = x_normalized.T @ y_normalized
+
+	# perfect correlations come out a little under 1 depending on rounding, which would give them a tiny p value instead of 0
+	perfect = np.abs(correlations) >= 1.0 - PERFECT_CORRELATION_ULPS * np.finfo(np.float64).eps
+
+	return np.where(perfect, np.sign(correlations), correlations)
+
+
+def get_pearson(x_values, y_values):
+	correlations = get_correlation_coefficients(x_values, y_values)
+
+	# two points are always on a line, scipy's pearsonr gives the direction with a p value of 1
+	if len(x_values) == 2:
+		correlations = np.sign(correlations)
+		return correlations, np.where(np.isnan(correlations), np.nan, 1.0)
+
+	# two sided p value from the beta distribution of r, same as scipy's pearsonr
+	ab = len(x_values) / 2 - 1
+	p_values = 2 * special.betainc(ab, ab, 0.5 * (1 - np.abs(correlations)))
+
+	return correlations, p_values
+
+
+def get_spearman(x_values, y_values):
+	# pearson correlation of the ranks, ties get their average rank
+	correlations = get_correlation_coefficients(rankdata(x_values, axis=0), rankdata(y_values, axis=0))
+
+	# two sided p value from the t distribution, same as scipy's spearmanr
+	dof = len(x_values) - 2
+
+	with np.errstate(invalid="ignore", divide="ignore"):
+		t = correlations * np.sqrt((dof / ((correlations + 1.0) * (1.0 - correlations))).clip(0))
+
+	p_values = 2 * t_distribution.sf(np.abs(t), dof)
+
+	return correlations, p_values
+
+
+def get_kendall_parallel(executor, workers, x_values, y_values):
+	if executor is None:
+		return get_kendall(x_values, y_values)
+
+	# split the x columns into chunks, each chunk is compared with every y column in a worker
+	chunk_count = min(x_values.shape[1], workers * KENDALL_CHUNKS_PER_WORKER)
+	chunks = np.array_split(np.arange(x_values.shape[1]), chunk_count)
+	futures = [executor.submit(get_kendall, x_values[:, chunk], y_values) for chunk in chunks]
+
+	results = [future.result() for future in futures]
+
+	return np.vstack([taus for taus, _ in results]), np.vstack([p_values for _, p_values in results])
+
+
+def get_kendall(x_values, y_values):
+	# kendall's tau-b between every column of x and every column of y, same as scipy's kendalltau
+	size = len(x_values)
+	total_pairs = size * (size - 1) // 2
+
+	# every column is ranked and sorted once, and the orders are reused for every pair
+	x_ranks = get_dense_ranks(x_values)
+	y_ranks = get_dense_ranks(y_values)
+	x_ties, x_tie_stats_0, x_tie_stats_1 = get_rank_ties(x_ranks)
+	y_ties, y_tie_stats_0, y_tie_stats_1 = get_rank_ties(y_ranks)
+
+	y_orders = np.argsort(y_ranks, axis=0, kind="stable")
+	y_sorted = np.take_along_axis(y_ranks, y_orders, axis=0)
+
+	taus = np.full((x_values.shape[1], y_values.shape[1]), np.nan)
+	p_values = np.full(taus.shape, np.nan)
+
+	for i in range(x_values.shape[1]):
+		# x in the order of each y column, then a stable sort on x orders every pair by x and then y
+		x_by_y = x_ranks[:, i][y_orders]
+		order = np.argsort(x_by_y, axis=0, kind="stable")
+		x_pairs = np.take_along_axis(x_by_y, order, axis=0).T
+		y_pairs = np.take_along_axis(y_sorted, order, axis=0).T
+
+		discordant = count_discordant(y_pairs)
+		joint_ties = count_joint_ties(x_pairs, y_pairs)
+
+		# constant columns have no correlation
+		valid = (x_ties[i] != total_pairs) & (y_ties != total_pairs)
+
+		with np.errstate(invalid="ignore", divide="ignore"):
+			con_minus_dis = total_pairs - x_ties[i] - y_ties + joint_ties - 2 * discordant
+			tau = con_minus_dis / np.sqrt(total_pairs - x_ties[i]) / np.sqrt(total_pairs - y_ties)
+
+			# con_minus_dis is approximately normally distributed with this variance
+			m = size * (size - 1.)
+			variance = (
+				(m * (2 * size + 5) - x_tie_stats_1[i] - y_tie_stats_1) / 18
+				+ (2 * x_ties[i] * y_ties) / m
+				+ x_tie_stats_0[i] * y_tie_stats_0 / (9 * m * (size - 2))
+			)
+			z = con_minus_dis / np.sqrt(variance)
+
+		taus[i] = np.where(valid, np.clip(tau, -1.0, 1.0), np.nan)
+		p_values[i] = np.where(valid, 2 * norm.sf(np.abs(z)), np.nan)
+
+		# scipy uses the exact distribution for small samples without ties, which is rare enough to hand to it
+		exact = valid & (x_ties[i] == 0) & (y_ties == 0) & ((size <= 33) | (np.minimum(discordant, total_pairs - discordant) <= 1))
+		for j in np.nonzero(exact)[0]:
+			p_values[i, j] = kendalltau(x_values[:, i], y_values[:, j]).pvalue
+
+	return taus, p_values
+
+
+def get_dense_ranks(values):
+	# 0 based ranks of each column where equal values get the same rank
+	order = np.argsort(values, axis=0, kind="stable")
+	sorted_values = np.take_along_axis(values, order, axis=0)
+
+	new_values = np.ones(values.shape, dtype=bool)
+	new_values[1:] = sorted_values[1:] != sorted_values[:-1]
+
+	ranks = np.empty(values.shape, dtype=np.int64)
+	np.put_along_axis(ranks, order, np.cumsum(new_values, axis=0) - 1, axis=0)
+
+	return ranks
+
+
+def get_rank_ties(ranks):
+	# tied pairs and the tie terms of the variance for each column
+	size, columns = ranks.shape
+	counts = np.bincount((ranks + np.arange(columns) * size).ravel(order="F"), minlength=size * columns).reshape(columns, size)
+	counts = np.where(counts > 1, counts, 0)
+
+	ties = (counts * (counts - 1) // 2).sum(axis=1)
+	tie_stats_0 = (counts * (counts - 1.) * (counts - 2)).sum(axis=1)
+	tie_stats_1 = (counts * (counts - 1.) * (2 * counts + 5)).sum(axis=1)
+
+	return ties, tie_stats_0, tie_stats_1
+
+
+def count_joint_ties(x_pairs, y_pairs):
+	# pairs tied in both x and y are next to each other once sorted by x and then y
+	pair_count, size = x_pairs.shape
+
+	new_runs = np.ones((pair_count, size), dtype=bool)
+	new_runs[:, 1:] = (x_pairs[:, 1:] != x_pairs[:, :-1]) | (y_pairs[:, 1:] != y_pairs[:, :-1])
+	run_ids = np.cumsum(new_runs, axis=1) - 1
+
+	run_lengths = np.bincount((run_ids + np.arange(pair_count)[:, None] * size).ravel(), minlength=pair_count * size)
+	run_lengths = run_lengths.reshape(pair_count, size)
+
+	return (run_lengths * (run_lengths - 1) // 2).sum(axis=1)
+
+
+def count_discordant(values):
+	# number of i < j with values[i] > values[j] in each row, using a bottom-up merge sort
+	# every row and every block is merged at once by offsetting the values into one sorted key space
+	pair_count, size = values.shape
+	discordant = np.zeros(pair_count, dtype=np.int64)
+	current = values.copy()
+	positions = np.arange(size)
+	width = 1
+
+	while width < size:
+		blocks = positions // (2 * width)
+		in_right = (positions % (2 * width)) >= width
+		offsets = blocks * size
+
+		# the stable sort keeps left values before equal right values, and sorts within each block
+		order = np.argsort(current + offsets, axis=1, kind="stable")
+		merged_positions = np.empty_like(order)
+		np.put_along_axis(merged_positions, order, positions, axis=1)
+
+		# each right value moves left past exactly the bigger left values
+		discordant += (positions[in_right] - merged_positions[:, in_right]).sum(axis=1)
+
+		current = np.take_along_axis(current, order, axis=1)
+		width *= 2
+
+	return discordant
@@ -1,7 +1,15 @@
+import os
+from dotenv import load_dotenv
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+# load env variables
+load_dotenv()
+
+# open each heatmap in a window after saving it (the pipeline turns this off so it doesn't wait for the windows to be closed)
+HEATMAP_SHOW = os.getenv("HEATMAP_SHOW", "1") == "1"
+
 def main():
 	# create heatmaps
 	create_correlation_heatmap("data/kendall_correlations.csv", "Kendall", min_correlation=0.15)
@@ -33,7 +41,15 @@ def create_correlation_heatmap(file, correlation_type, min_correlation=0.15, max
 	)
 
 	plt.tight_layout()
-	plt.show()
+
+	path = f"data/{correlation_type.lower()}_heatmap.png"
+	plt.savefig(path)
+	print(f"{correlation_type} heatmap saved to {path}")
+
+	if HEATMAP_SHOW:
+		plt.show()
+	else:
+		plt.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+def get_distributions(values, prefixes, weights=None):
+	# summary statistics for every row of a 2-D array in one pass, one row per prefix
+	# missing values are NaN and are skipped like pandas does
+	# weights are how many times each column of values appears, which gives the same stats as repeating it
+	# the arithmetic follows pandas and np.percentile step by step so the results are identical
+	if not prefixes:
+		return {}
+
+	values = np.ascontiguousarray(values, dtype=np.float64).reshape(len(prefixes), -1)
+	weights = np.ones(values.shape[1]) if weights is None else np.asarray(weights, dtype=np.float64)
+
+	# columns without any rows have the same stats as columns with only missing values
+	if values.shape[1] == 0:
+		values = np.full((len(prefixes), 1), np.nan)
+		weights = np.ones(1)
+
+	mask = np.isnan(values)
+	value_weights = np.where(mask, 0.0, weights)
+	counts = value_weights.sum(axis=1)
+	filled = np.where(mask, 0.0, values)
+
+	# NaN ends up at the end of each sorted row
+	order = np.argsort(values, axis=1, kind="stable")
+	sorted_values = np.take_along_axis(values, order, axis=1)
+	cumulative_weights = np.cumsum(np.take_along_axis(value_weights, order, axis=1), axis=1)
+
+	with np.errstate(invalid="ignore", divide="ignore"):
+		q1 = get_quantiles(sorted_values, cumulative_weights, counts, 0.25)
+		median = get_medians(sorted_values, cumulative_weights, counts)
+		q3 = get_quantiles(sorted_values, cumulative_weights, counts, 0.75)
+
+		min_values = np.where(counts > 0, get_values_at(sorted_values, cumulative_weights, np.zeros(len(counts))), np.nan)
+		max_values = np.where(counts > 0, get_values_at(sorted_values, cumulative_weights, counts - 1), np.nan)
+
+		means = (filled * weights).sum(axis=1) / counts
+
+		# sample standard deviation using the two pass algorithm
+		squared = np.where(mask, 0.0, (means[:, None] - filled) ** 2)
+		std_devs = np.sqrt((squared * weights).sum(axis=1) / np.where(counts <= 1, np.nan, counts - 1))
+
+		skewnesses = get_skewnesses(filled, mask, weights, means, counts)
+
+	stats = {}
+
+	for i, prefix in enumerate(prefixes):
+		stats[prefix + "_q1"] = float(q1[i])
+		stats[prefix + "_median"] = float(median[i])
+		stats[prefix + "_q3"] = float(q3[i])
+		stats[prefix + "_range"] = float(max_values[i] - min_values[i])
+		stats[prefix + "_iqr"] = float(q3[i] - q1[i])
+		stats[prefix + "_std_dev"] = float(std_devs[i]) if not np.isnan(std_devs[i]) else None
+		stats[prefix + "_min"] = float(min_values[i])
+		stats[prefix + "_max"] = float(max_values[i])
+		stats[prefix + "_mean"] = float(means[i])
+		stats[prefix + "_skewness"] = float(skewnesses[i]) if not np.isnan(skewnesses[i]) else None
+
+	return stats
+
+
+def get_values_at(sorted_values, cumulative_weights, positions):
+	# value at each position of the sorted rows if every value was repeated by its weight
+	indexes = (cumulative_weights <= positions[:, None]).sum(axis=1)
+	indexes = np.minimum(indexes, sorted_values.shape[1] - 1)
+
+	return sorted_values[np.arange(len(positions)), indexes]
+
+
+def get_quantiles(sorted_values, cumulative_weights, counts, q):
+	# linear interpolation between the two closest values
+	positions = (counts - 1) * q
+
+	lower_positions = np.floor(positions)
+	gamma = positions - lower_positions
+
+	last_positions = np.maximum(counts - 1, 0)
+	lower_positions = np.clip(lower_positions, 0, last_positions)
+	upper_positions = np.minimum(lower_positions + 1, last_positions)
+
+	lower = get_values_at(sorted_values, cumulative_weights, lower_positions)
+	upper = get_values_at(sorted_values, cumulative_weights, upper_positions)
+
+	# np.percentile switches which end it interpolates from at the halfway point
+	difference = upper - lower
+	quantiles = np.where(gamma >= 0.5, upper - difference * (1 - gamma), lower + difference * gamma)
+
+	# past the last value there is nothing to interpolate with
+	quantiles = np.where(positions >= counts - 1, upper, quantiles)
+
+	return np.where(counts > 0, quantiles, np.nan)
+
+
+def get_medians(sorted_values, cumulative_weights, counts):
+	# middle value, or the mean of the two middle values
+	upper = get_values_at(sorted_values, cumulative_weights, np.floor(counts / 2))
+	lower = get_values_at(sorted_values, cumulative_weights, np.maximum(np.floor((counts - 1) / 2), 0))
+
+	medians = np.where(counts % 2 == 1, upper, (lower + upper) / 2.0)
+
+	return np.where(counts > 0, medians, np.nan)
+
+
+def get_skewnesses(filled, mask, weights, means, counts):
+	# adjusted Fisher-Pearson skewness, same as pandas
+	adjusted = np.where(mask, 0.0, filled - means[:, None])
+	adjusted2 = adjusted ** 2
+	adjusted3 = adjusted2 * adjusted
+
+	m2 = (adjusted2 * weights).sum(axis=1)
+	m3 = (adjusted3 * weights).sum(axis=1)
+
+	# treat floating point error as 0
+	m2 = np.where(np.abs(m2) < 1e-14, 0, m2)
+	m3 = np.where(np.abs(m3) < 1e-14, 0, m3)
+
+	# the moments above are the expensive part, the rest is one value per column
+	# it's done on scalars because numpy's vectorized pow can round differently than pandas
+	return np.array([get_skewness(count, m2_value, m3_value) for count, m2_value, m3_value in zip(counts, m2, m3)], dtype=np.float64)
+
+
+def get_skewness(count, m2, m3):
+	# undefined with fewer than 3 values, and constant columns have no skew
+	if count < 3:
+		return np.nan
+
+	if m2 == 0:
+		return 0.0
+
+	return (count * (count - 1) ** 0.5 / (count - 2)) * (m3 / m2 ** 1.5)
@@ -1,9 +1,12 @@
-import requests
 import random
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 import os
 from dotenv import load_dotenv
+from http_client import HttpSession, HTTP_POOL_SIZE
+from sqlite_cache import SqliteCache
 
 # load env variables
 load_dotenv()
@@ -15,14 +18,31 @@ SERVER_CANDIDATE_POOL_SIZE = int(os.getenv("SERVER_CANDIDATE_POOL_SIZE"))
 # how many servers to randomly include in the sample from the candidate pool
 SERVER_SAMPLE_SIZE = int(os.getenv("SERVER_SAMPLE_SIZE"))
 
+# can be pointed at a local mock for testing
+TOPGG_API_URL = os.getenv("TOPGG_API_URL", "https://api.top.gg/graphql")
+
+# servers fetched per request, and how many requests go at once
+TOPGG_PAGE_SIZE = int(os.getenv("TOPGG_PAGE_SIZE", "100"))
+TOPGG_FETCH_WORKERS = int(os.getenv("TOPGG_FETCH_WORKERS", "4"))
+
+# where pages from top.gg are cached (empty disables the cache), and how many hours they're used for
+TOPGG_CACHE_PATH = os.getenv("TOPGG_CACHE_PATH", "data/topgg_cache.sqlite")
+TOPGG_CACHE_TTL_HOURS = float(os.getenv("TOPGG_CACHE_TTL_HOURS", "24"))
+
+# makes the sample the same on every run with the same candidate pool (empty is random every time)
+SAMPLE_SEED = os.getenv("SAMPLE_SEED", "")
+
+# retries rate limits and server errors from top.gg
+http_session = HttpSession(pool_size=max(HTTP_POOL_SIZE, TOPGG_FETCH_WORKERS))
+
 def main():
     # get candidate pool
     candidate_pool = get_candidate_pool(SERVER_CANDIDATE_POOL_SIZE)
-    print(f"Created candidate pool from the {SERVER_CANDIDATE_POOL_SIZE} top servers.")
+    print(f"Created candidate pool from the {len(candidate_pool)} top servers.")
 
     # get sample
     sample = select_random_sample_from_candidate_pool(candidate_pool, SERVER_SAMPLE_SIZE)
-    print(f"Created sample of {SERVER_SAMPLE_SIZE} random servers.")
+    print(f"Created sample of {len(sample)} random servers.")
 
     # save sample to json
     with open("data/servers.json", "w", encoding="utf-8") as f:
@@ -30,7 +50,80 @@ def main():
         
     print("Server sample data saved to data/servers.json")
 
+    # nothing to report when every page was cached
+    if http_session.metrics:
+        print(http_session.get_report())
+
 def get_candidate_pool(size):
+    # pages are cached as soon as they arrive, so a run that stops partway only fetches what's left next time
+    # and sampling again with a different size or seed doesn't fetch anything
+    cache = None
+    if TOPGG_CACHE_PATH:
+        os.makedirs(os.path.dirname(TOPGG_CACHE_PATH) or ".", exist_ok=True)
+        cache = SqliteCache(TOPGG_CACHE_PATH, "pages", ttl=TOPGG_CACHE_TTL_HOURS * 60 * 60)
+
+    # pages in the order of the listing, with the last one cut to size
+    pages = [(skip, min(TOPGG_PAGE_SIZE, size - skip)) for skip in range(0, size, TOPGG_PAGE_SIZE)]
+
+    # server id -> node, pages cached at different times can overlap if the listing changed in between
+    # so a server listed twice is only kept where it first shows up, and can't be sampled twice
+    candidate_servers = {}
+    duplicates = 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=TOPGG_FETCH_WORKERS) as executor:
+            # pages come back in order, so the pool is the same however the requests finish
+            for nodes in executor.map(lambda page: get_candidate_page(cache, *page), pages):
+                for node in nodes:
+                    if node["id"] in candidate_servers:
+                        duplicates += 1
+                    else:
+                        candidate_servers[node["id"]] = node
+    finally:
+        if cache is not None:
+            print(f"top.gg page cache hits: {cache.hits}, misses: {cache.misses}")
+            cache.close()
+
+    if duplicates:
+        print(f"Skipped {duplicates} servers listed more than once")
+
+    return list(candidate_servers.values())
+
+def get_candidate_page(cache, skip, limit):
+    request_body = get_request_body(skip, limit)
+
+    # pages are cached by the whole request, so changing the query or its filters fetches them again
+    key = hashlib.sha256(json.dumps(request_body, sort_keys=True).encode("utf-8")).hexdigest()
+
+    if cache is not None:
+        cached = cache.get_many([key])
+        if key in cached:
+            return cached[key]
+
+    print(f"Fetching servers {skip + 1}-{skip + limit} from top.gg")
+
+    # fetch servers from top.gg api
+    response = http_session.post(
+        TOPGG_API_URL,
+        json=request_body,
+        headers={"content-type": "application/json"}
+    )
+
+    data = response.json()
+
+    # graphql errors still come back as 200, and shouldn't be cached
+    if data.get("errors"):
+        raise RuntimeError(f"top.gg returned errors for servers {skip + 1}-{skip + limit}: {data['errors']}")
+
+    # parse list of servers from data
+    nodes = data["data"]["entitiesV2"]["nodes"]
+
+    if cache is not None:
+        cache.set_many({key: nodes})
+
+    return nodes
+
+def get_request_body(skip, limit):
     # format request query
     query = """
     query Entities($input: EntitiesListingParametersInput!) {
@@ -89,12 +182,12 @@ def get_candidate_pool(size):
     """
 
     # format body
-    request_body = {
+    return {
         "query": query,
         "variables": {
             "input": {
-                "limit": size,
-                "skip": 0,
+                "limit": limit,
+                "skip": skip,
                 "sortOrder": "TOTAL_SIZE",
                 "tagSlugs": [],
                 "languageCodes": [],
@@ -107,22 +200,10 @@ def get_candidate_pool(size):
         "operationName": "Entities"
     }
 
-    # fetch servers from top.gg api
-    response = requests.post(
-        "https://api.top.gg/graphql",
-        json=request_body,
-        headers={"content-type": "application/json"}
-    )
-    
-    data = response.json()
-
-    # parse list of servers from data
-    candidate_servers = data["data"]["entitiesV2"]["nodes"]
-    return candidate_servers
-
 def select_random_sample_from_candidate_pool(candidate_pool, sample_size):
     # select a random sample
-    return random.sample(candidate_pool, min(sample_size, len(candidate_pool)))
+    rng = random.Random(f"{SAMPLE_SEED}:servers") if SAMPLE_SEED else random
+    return rng.sample(candidate_pool, min(sample_size, len(candidate_pool)))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,10 +1,16 @@
-import random
+import asyncio
+import functools
+import hashlib
+import heapq
 import os
-import json
-import time
+from array import array
 from dotenv import load_dotenv
 import discord
+import numpy as np
 from discord import ConnectionType
+from rate_limiter import TokenBucket, get_retry_after
+from scrape_checkpoint import ScrapeCheckpoint
+from storage import get_path, write_users
 
 # load env variables
 load_dotenv()
@@ -13,6 +19,35 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 CHANNEL_HISTORY_LIMIT = int(os.getenv("CHANNEL_HISTORY_LIMIT"))
 USER_STRATUM_SIZE = int(os.getenv("USER_STRATUM_SIZE"))
 
+# how many channel histories are read at the same time, shared by all servers
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "1"))
+
+# profile lookups per second shared by all servers, and how many can go at once after being idle
+# the default is one every 2.5 seconds so we don't get banned LMAO
+PROFILE_FETCH_RATE = float(os.getenv("PROFILE_FETCH_RATE", "0.4"))
+PROFILE_FETCH_BURST = int(os.getenv("PROFILE_FETCH_BURST", "1"))
+
+# how many times a profile lookup is tried when discord says to slow down
+PROFILE_FETCH_ATTEMPTS = 3
+
+# how many profiles of each server are fetched at the same time, they all share the rate limit
+PROFILE_WORKERS = int(os.getenv("PROFILE_WORKERS", "1"))
+
+# progress is appended here as it happens so a restarted run skips what's done, empty turns it off
+SCRAPE_CHECKPOINT_PATH = os.getenv("SCRAPE_CHECKPOINT_PATH", "data/scrape_checkpoint.jsonl")
+
+# how many messages of a channel are scanned between checkpoint saves
+CHECKPOINT_FLUSH_SIZE = 1000
+
+# only keep the users that can still make it into the sample while scraping, so memory doesn't grow with the server
+STREAMING_SAMPLE = os.getenv("STREAMING_SAMPLE", "0") == "1"
+
+# makes the samples reproducible, leave empty for a different sample every run (a resumed run keeps the one in its checkpoint)
+SAMPLE_SEED = os.getenv("SAMPLE_SEED", "")
+
+# dropped messages are only cleared out of memory once there are at least this many
+ARENA_COMPACT_MIN = 100000
+
 
 def main():
 	client = DiscordClient()
@@ -27,38 +62,60 @@ class DiscordClient(discord.Client):
 
 
 	async def scrape_all_servers(self):
-		server_samples = []
-
 		# get all servers
 		servers = self.guilds
 
-		for server in servers:
-			# fetch server from id
-			guild_id = int(server.id)
-			guild = self.get_guild(guild_id)
+		# fetch servers from ids
+		guilds = [self.get_guild(int(server.id)) for server in servers]
+
+		# scrape servers at the same time, the semaphore limits how many channels are read at once
+		semaphore = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+		rate_limiter = TokenBucket(PROFILE_FETCH_RATE, PROFILE_FETCH_BURST)
+		checkpoint = ScrapeCheckpoint(SCRAPE_CHECKPOINT_PATH, SAMPLE_SEED)
+
+		try:
+			server_users = await asyncio.gather(*(scrape_server(self, guild, semaphore, rate_limiter, checkpoint) for guild in guilds))
+		finally:
+			checkpoint.close()
 
-			# scrape server
-			server_sample = await scrape_server(guild)
+		print(f"Profile lookups: {rate_limiter.get_report()}")
+
+		# sample in server order so the samples don't depend on which server finished first
+		server_samples = []
+
+		for server, guild, (users, arena) in zip(servers, guilds, server_users):
+			server_sample = get_server_sample(guild, users, arena)
 			server_sample["topgg_data"] = server
 
 			server_samples.append(server_sample)
 
-		# save sample to json
-		with open("data/users.json", "w", encoding="utf-8") as f:
-			json.dump(server_samples, f, ensure_ascii=False, indent=2, default=str)
+		# save sample in the configured format
+		write_users(server_samples)
 			
-		print("User sample data saved to data/users.json")
+		print(f"User sample data saved to {get_path('users')}")
+
+		if SCRAPE_CHECKPOINT_PATH:
+			print(f"Delete {SCRAPE_CHECKPOINT_PATH} to scrape from scratch next time")
 
+		# run() only returns once the client is closed, so the script can exit
+		await self.close()
 
-async def scrape_server(guild):
+
+async def scrape_server(client, guild, semaphore, rate_limiter, checkpoint):
 		print(f"Scraping server {guild}")
 
 		# scrape messages and users
-		users = await scrape_users(guild)
+		return await scrape_users(client, guild, semaphore, rate_limiter, checkpoint.get_guild(guild.id))
+
 
+def get_server_sample(guild, users, arena):
 		# get random sample of users
 		spotify_sample = select_random_user_sample(users["spotify_stratum"], USER_STRATUM_SIZE)
 		non_spotify_sample = select_random_user_sample(users["non_spotify_stratum"], USER_STRATUM_SIZE)
+
+		# only the sampled users' messages are decoded
+		spotify_sample = {k: get_user_data(record, arena) for k, record in spotify_sample.items()}
+		non_spotify_sample = {k: get_user_data(record, arena) for k, record in non_spotify_sample.items()}
 		
 		server_sample = {
 			"guild": guild,
@@ -69,96 +126,395 @@ async def scrape_server(guild):
 		return server_sample
 
 
-async def scrape_users(guild):
+async def scrape_users(client, guild, semaphore, rate_limiter, guild_checkpoint):
 	users = {
 		"spotify_stratum": {},
 		"non_spotify_stratum": {},
 	}
 
 	# keep track of users we failed to fetch so we don't try again
-	failed_fetch_users = []
+	failed_fetch_users = set()
+
+	# every user found in the server and all of their messages
+	authors = {}
+	arena = MessageArena()
+
+	# users that can't make it into the sample anymore are dropped as we go
+	sample = StreamingSample(USER_STRATUM_SIZE, arena, authors) if STREAMING_SAMPLE else None
+
+	# new users are queued while reading channels and their profiles are fetched in the background
+	# users with smaller sample keys go first, so the sample fills up with the users most likely to stay in it
+	profile_queue = asyncio.PriorityQueue()
+
+	# put back what a previous run already scraped
+	restore_checkpoint(guild_checkpoint, arena, authors, failed_fetch_users, profile_queue, sample)
+
+	if guild_checkpoint.done:
+		print(f"Server {guild} was already scraped")
+	else:
+		# get channels list
+		channels = await guild.fetch_channels()
+		channels = [channel for channel in channels if is_scrapable_channel(channel, guild)]
+
+		workers = [
+			asyncio.create_task(fetch_profiles(client, profile_queue, rate_limiter, authors, failed_fetch_users, guild_checkpoint, sample))
+			for _ in range(PROFILE_WORKERS)
+		]
+
+		try:
+			# read channel histories at the same time
+			await asyncio.gather(*(
+				scrape_channel(channel, i, semaphore, arena, authors, failed_fetch_users, profile_queue, guild_checkpoint, sample)
+				for i, channel in enumerate(channels)
+			))
+
+			# wait for the profiles that are left
+			await profile_queue.join()
+		finally:
+			for worker in workers:
+				worker.cancel()
+
+		guild_checkpoint.save_done()
+
+	# put users and messages in the same order as reading the channels one after another
+	read_order = arena.get_read_order()
+
+	for record in authors.values():
+		indexes = np.frombuffer(record.message_indexes, dtype=np.uint32)
+		record.message_indexes = array("I", indexes[np.argsort(read_order[indexes], kind="stable")].tobytes())
+
+	for record in sorted(authors.values(), key=lambda record: read_order[record.message_indexes[0]]):
+		# skip users we failed to fetch
+		if record.id in failed_fetch_users:
+			continue
 
-	# get channels list
-	channels = await guild.fetch_channels()
+		# save user data in appropriate stratum
+		if record.spotify_url == None:
+			users["non_spotify_stratum"][record.id] = record
+		else :
+			users["spotify_stratum"][record.id] = record
 
-	# loop through channels
-	for channel in channels:
-		# make sure they're writable
-		# this avoids announcement channels and shit
-		if not channel.permissions_for(guild.me).send_messages:
-			continue
+	return users, arena
 
-		# make sure they're text channels
-		if not isinstance(channel, discord.TextChannel):
-			continue
 
+class MessageArena:
+	# messages of a server stored back to back in one utf-8 buffer instead of a string object each
+	__slots__ = ("data", "offsets", "channels", "dropped")
+
+	def __init__(self):
+		self.data = bytearray()
+		self.offsets = array("q", [0])
+
+		# which channel each message is from
+		self.channels = array("I")
+
+		# how many messages belong to users that were dropped
+		self.dropped = 0
+
+	def append(self, content, channel_index):
+		# returns the index of the message
+		self.data += content.encode("utf-8", "surrogatepass")
+		self.offsets.append(len(self.data))
+		self.channels.append(channel_index)
+
+		return len(self.channels) - 1
+
+	def get(self, i):
+		return self.data[self.offsets[i]:self.offsets[i + 1]].decode("utf-8", "surrogatepass")
+
+	def compact(self, records):
+		# rewrite the buffer with only the messages of these records, keeping their order
+		keep = np.zeros(len(self.channels), dtype=bool)
+		for record in records:
+			keep[np.frombuffer(record.message_indexes, dtype=np.uint32)] = True
+
+		lengths = np.diff(np.frombuffer(self.offsets, dtype=np.int64))
+		data = np.frombuffer(self.data, dtype=np.uint8)[np.repeat(keep, lengths)]
+
+		self.data = bytearray(data.tobytes())
+		self.offsets = array("q", np.concatenate(([0], np.cumsum(lengths[keep]))).tobytes())
+		self.channels = array("I", np.frombuffer(self.channels, dtype=np.uint32)[keep].tobytes())
+		self.dropped = 0
+
+		new_indexes = (np.cumsum(keep) - 1).astype(np.uint32)
+		for record in records:
+			record.message_indexes = array("I", new_indexes[np.frombuffer(record.message_indexes, dtype=np.uint32)].tobytes())
+
+	def get_read_order(self):
+		# position of each message if the channels were read one after another instead of at the same time
+		order = np.argsort(np.frombuffer(self.channels, dtype=np.uint32), kind="stable")
+
+		positions = np.empty(len(order), dtype=np.int64)
+		positions[order] = np.arange(len(order))
+
+		return positions
+
+
+class AuthorRecord:
+	# what is kept for each user, the discord object is only used to fetch the profile
+	__slots__ = ("id", "spotify_url", "sample_key", "message_indexes")
+
+	def __init__(self, author_id, sample_key):
+		self.id = author_id
+		self.spotify_url = None
+
+		# users with the smallest keys are sampled
+		self.sample_key = sample_key
+
+		# indexes of the user's messages in the arena
+		self.message_indexes = array("I")
+
+
+class StreamingSample:
+	# the users with the smallest sample keys in a stratum are a uniform random sample of it,
+	# so only those are kept once a stratum has enough users, whatever order profiles are fetched in
+
+	def __init__(self, sample_size, arena, authors):
+		self.sample_size = sample_size
+		self.arena = arena
+		self.authors = authors
+
+		# max heaps of (-sample key, author id) for each stratum
+		self.reservoirs = {"spotify_stratum": [], "non_spotify_stratum": []}
+
+		# users whose messages aren't needed anymore
+		self.dropped_users = set()
+
+	def get_limit(self):
+		# users with a bigger key than this can't get into either stratum anymore
+		if any(len(reservoir) < self.sample_size for reservoir in self.reservoirs.values()):
+			return float("inf")
+
+		return max(-reservoir[0][0] for reservoir in self.reservoirs.values())
+
+	def add(self, record):
+		# called once the user's profile is fetched
+		stratum = "non_spotify_stratum" if record.spotify_url == None else "spotify_stratum"
+		reservoir = self.reservoirs[stratum]
+
+		if len(reservoir) < self.sample_size:
+			heapq.heappush(reservoir, (-record.sample_key, record.id))
+		elif record.sample_key < -reservoir[0][0]:
+			# replace the user with the biggest key
+			_, evicted_id = heapq.heapreplace(reservoir, (-record.sample_key, record.id))
+			self.drop(evicted_id)
+		else:
+			self.drop(record.id)
+
+	def drop(self, author_id):
+		record = self.authors.pop(author_id, None)
+		self.dropped_users.add(author_id)
+
+		if record is None:
+			return
+
+		# clear out dropped messages once they're most of the arena
+		self.arena.dropped += len(record.message_indexes)
+		if self.arena.dropped >= max(ARENA_COMPACT_MIN, len(self.arena.channels) // 2):
+			self.arena.compact(self.authors.values())
+
+
+def get_sample_key(guild_checkpoint, author_id):
+	# random number for each user, the same for every run with the checkpoint's seed
+	seed = guild_checkpoint.checkpoint.seed
+	digest = hashlib.blake2b(f"{seed}:{guild_checkpoint.guild_id}:{author_id}".encode("utf-8"), digest_size=8).digest()
+	return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def get_user_data(record, arena):
+	# create object for user to store messages and user data
+	return {
+		"messages": [arena.get(i) for i in record.message_indexes],
+		"spotifyUrl": record.spotify_url
+	}
+
+
+def is_scrapable_channel(channel, guild):
+	# make sure they're writable
+	# this avoids announcement channels and shit
+	if not channel.permissions_for(guild.me).send_messages:
+		return False
+
+	# make sure they're text channels
+	return channel.type in (discord.ChannelType.text, discord.ChannelType.news)
+
+
+def restore_checkpoint(guild_checkpoint, arena, authors, failed_fetch_users, profile_queue, sample):
+	for channel in guild_checkpoint.channels.values():
+		for author_id, content in channel["messages"]:
+			if author_id not in authors:
+				authors[author_id] = AuthorRecord(author_id, get_sample_key(guild_checkpoint, author_id))
+
+			authors[author_id].message_indexes.append(arena.append(content, channel["index"]))
+
+	guild_checkpoint.clear_messages()
+
+	failed_fetch_users.update(guild_checkpoint.failed_users)
+
+	for author_id, record in list(authors.items()):
+		if author_id in guild_checkpoint.spotify_urls:
+			record.spotify_url = guild_checkpoint.spotify_urls[author_id]
+
+			if sample is not None:
+				sample.add(record)
+
+		elif author_id in failed_fetch_users:
+			if sample is not None:
+				sample.drop(author_id)
+
+		# users whose profile wasn't fetched yet, only their id is known
+		else:
+			profile_queue.put_nowait((record.sample_key, author_id, None))
+
+
+async def scrape_channel(channel, channel_index, semaphore, arena, authors, failed_fetch_users, profile_queue, guild_checkpoint, sample):
+	# pick up where a previous run stopped reading this channel
+	progress = guild_checkpoint.channels.get(channel.id)
+
+	if progress is not None:
+		if progress["done"]:
+			return
+
+		channel_index = progress["index"]
+		scanned = progress["scanned"]
+		before = discord.Object(id=progress["last_message_id"]) if progress["last_message_id"] else None
+	else:
+		scanned = 0
+		before = None
+
+	if scanned >= CHANNEL_HISTORY_LIMIT:
+		guild_checkpoint.save_messages(channel.id, channel_index, [], 0, None, True)
+		return
+
+	# messages that haven't been saved to the checkpoint yet
+	unsaved = []
+	unsaved_scanned = 0
+	last_message_id = None
+
+	async with semaphore:
 		print(f"Scraping channel {channel.name}")
 
 		# get message history
-		async for message in channel.history(limit=CHANNEL_HISTORY_LIMIT):
+		async for message in channel.history(limit=CHANNEL_HISTORY_LIMIT - scanned, before=before):
+			# save progress every so often
+			if unsaved_scanned >= CHECKPOINT_FLUSH_SIZE:
+				guild_checkpoint.save_messages(channel.id, channel_index, unsaved, unsaved_scanned, last_message_id, False)
+				unsaved = []
+				unsaved_scanned = 0
+
+			unsaved_scanned += 1
+			last_message_id = message.id
+
 			# TODO: don't store any identifiable data (except for message content)
 			author = message.author
 
 			# skip bot messages
 			if author.bot:
 				continue
-			
+
 			# check if already previously checked this user
 			if author.id in failed_fetch_users:
 				continue
-			elif author.id in users["spotify_stratum"]:
-				# add new message to list
-				users["spotify_stratum"][author.id]["messages"].append(message.content)
 
-			# check if already in non spotify stratum
-			elif author.id in users["non_spotify_stratum"]:
-				# add new message to list
-				users["non_spotify_stratum"][author.id]["messages"].append(message.content)
+			# skip users that were dropped from the sample
+			if sample is not None and author.id in sample.dropped_users:
+				continue
+
+			record = authors.get(author.id)
 
 			# new user found
-			else:
+			if record is None:
 				print(f"Found user {author.name}")
 
-				# get profile and spotify connection
-				spotify_url = None
+				record = authors[author.id] = AuthorRecord(author.id, get_sample_key(guild_checkpoint, author.id))
+				profile_queue.put_nowait((record.sample_key, author.id, author))
+
+			# drop users that can't get into the sample anymore
+			if sample is not None and record.sample_key > sample.get_limit():
+				sample.drop(author.id)
+				continue
+
+			# add new message
+			record.message_indexes.append(arena.append(message.content, channel_index))
+			unsaved.append((author.id, message.content))
+
+	guild_checkpoint.save_messages(channel.id, channel_index, unsaved, unsaved_scanned, last_message_id, True)
+
+
+async def fetch_profiles(client, profile_queue, rate_limiter, authors, failed_fetch_users, guild_checkpoint, sample):
+	while True:
+		_, author_id, author = await profile_queue.get()
+
+		# no need to fetch users that were dropped from the sample
+		if sample is not None and (author_id not in authors or authors[author_id].sample_key > sample.get_limit()):
+			sample.drop(author_id)
+			profile_queue.task_done()
+			continue
+
+		try:
+			# users from a previous run are only known by id and might have left the server since, so they're looked up as users
+			if author is None:
+				fetch_profile = functools.partial(client.fetch_user_profile, author_id)
+			else:
+				fetch_profile = author.profile
+
+			spotify_url = await get_spotify_url(fetch_profile, rate_limiter)
+		except Exception:
+			print("Failed to fetch profile")
+			failed_fetch_users.add(author_id)
+			guild_checkpoint.save_profile(author_id, None, True)
+
+			if sample is not None:
+				sample.drop(author_id)
+		else:
+			guild_checkpoint.save_profile(author_id, spotify_url, False)
+
+			# the user might have been dropped from the sample while their profile was being fetched
+			record = authors.get(author_id)
+
+			if record is not None:
+				record.spotify_url = spotify_url
+
+				if sample is not None:
+					sample.add(record)
+		finally:
+			profile_queue.task_done()
+
+
+async def get_spotify_url(fetch_profile, rate_limiter):
+	# get profile and spotify connection
+	spotify_url = None
 
-				try:
-					# wait a second so we don't get banned LMAO
-					time.sleep(2.5)
+	for attempt in range(PROFILE_FETCH_ATTEMPTS):
+		# wait for our turn without blocking the channels that are being read
+		await rate_limiter.acquire()
 
-					profile = await author.profile()
-					connections = profile.connections
+		try:
+			profile = await fetch_profile()
+			break
+		except Exception as e:
+			# only rate limits are worth trying again
+			retry_after = get_retry_after(e)
+			if retry_after is None or attempt == PROFILE_FETCH_ATTEMPTS - 1:
+				raise
 
-					for connection in connections:
-						# check if spotify
-						if connection.type == ConnectionType.spotify:
-							# save url
-							spotify_url = connection.url
-							print("Found Spotify account")
-				except:
-					print("Failed to fetch profile")
-					failed_fetch_users.append(author.id)
-					continue
+			rate_limiter.throttle(retry_after)
 
-				# create object for user to store messages and user data
-				author_data = {
-					"user": author,
-					"messages": [message.content],
-					"spotifyUrl": spotify_url
-				}
+	connections = profile.connections
 
-				# save user data in appropriate stratum
-				if spotify_url == None:
-					users["non_spotify_stratum"][author.id] = author_data
-				else :
-					users["spotify_stratum"][author.id] = author_data
+	for connection in connections:
+		# check if spotify
+		if connection.type == ConnectionType.spotify:
+			# save url
+			spotify_url = connection.url
+			print("Found Spotify account")
 
-	return users
+	return spotify_url
 
 
 def select_random_user_sample(users, sample_size):
-	# select a random sample of dict keys
-	sampled_keys = random.sample(list(users), min(sample_size, len(users)))
+	# select a random sample of dict keys, the users with the smallest sample keys
+	sampled_keys = heapq.nsmallest(sample_size, users, key=lambda k: users[k].sample_key)
 
 	# rebuilds user dict using sampled keys
 	sample = {k: users[k] for k in sampled_keys}
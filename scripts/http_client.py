@@ -0,0 +1,157 @@
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+# load env variables
+load_dotenv()
+
+# how many times a failed request is tried again before giving up
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+
+# seconds before the first retry, doubled after every retry up to the max, with random jitter
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "1"))
+HTTP_MAX_BACKOFF = float(os.getenv("HTTP_MAX_BACKOFF", "60"))
+
+# seconds to wait for a response when the caller doesn't say
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+# connections kept open to each host
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+# responses worth trying again, anything else goes straight back to the caller
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpSession(requests.Session):
+	# session that keeps connections alive between requests, retries failed ones and records how each endpoint does
+	# it's a regular requests session, so it can be handed to clients like spotipy and their requests get the same treatment
+	# rate_limiter is an optional ThreadTokenBucket every attempt waits on, and a Retry-After pauses it for every thread
+
+	def __init__(self, rate_limiter=None, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_BACKOFF, max_backoff=HTTP_MAX_BACKOFF, timeout=HTTP_TIMEOUT, pool_size=HTTP_POOL_SIZE):
+		super().__init__()
+		self.rate_limiter = rate_limiter
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.timeout = timeout
+
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+		self.mount("http://", adapter)
+		self.mount("https://", adapter)
+
+		# endpoint -> EndpointMetrics
+		self.metrics = {}
+		self.metrics_lock = threading.Lock()
+
+	def request(self, method, url, **kwargs):
+		# returns the response, raising once retries run out on a connection error or a status worth retrying
+		if kwargs.get("timeout") is None:
+			kwargs["timeout"] = self.timeout
+
+		metrics = self.get_metrics(get_endpoint(method, url))
+
+		for attempt in range(self.max_retries + 1):
+			if self.rate_limiter is not None:
+				self.rate_limiter.acquire()
+
+			start = time.monotonic()
+
+			try:
+				response = super().request(method, url, **kwargs)
+				error = None
+			except (requests.ConnectionError, requests.Timeout) as e:
+				response = None
+				error = e
+
+			failed = response is None or response.status_code in RETRY_STATUSES
+
+			with self.metrics_lock:
+				metrics.add(time.monotonic() - start, attempt > 0, failed)
+
+			if not failed:
+				return response
+
+			if attempt == self.max_retries:
+				break
+
+			retry_after = get_retry_after(response)
+			delay = retry_after if retry_after is not None else self.get_backoff(attempt)
+			print(f"{method} {url} failed with {error or response.status_code}, retrying in {delay:.1f} seconds")
+
+			# a rate limit applies to everyone using the limiter, not just this request
+			if retry_after is not None and self.rate_limiter is not None:
+				self.rate_limiter.throttle(retry_after)
+			else:
+				time.sleep(delay)
+
+		if error is not None:
+			raise error
+
+		response.raise_for_status()
+
+	def get_backoff(self, attempt):
+		# exponential backoff, with jitter so requests that failed together don't retry together
+		delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+		return delay * random.uniform(0.5, 1)
+
+	def get_metrics(self, endpoint):
+		with self.metrics_lock:
+			if endpoint not in self.metrics:
+				self.metrics[endpoint] = EndpointMetrics()
+
+			return self.metrics[endpoint]
+
+	def get_report(self):
+		# one line per endpoint
+		return "\n".join(f"{endpoint}: {metrics.get_report()}" for endpoint, metrics in sorted(self.metrics.items()))
+
+
+class EndpointMetrics:
+	# attempts and their latencies for one endpoint
+
+	def __init__(self):
+		self.latencies = []
+		self.retries = 0
+		self.failures = 0
+
+	def add(self, latency, retry, failed):
+		self.latencies.append(latency)
+		self.retries += retry
+		self.failures += failed
+
+	def get_report(self):
+		latencies = np.array(self.latencies) * 1000
+		return (
+			f"{len(latencies)} attempts, {self.retries} retries, {self.failures} failed, "
+			f"latency mean {latencies.mean():.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms, max {latencies.max():.0f} ms"
+		)
+
+
+def get_endpoint(method, url):
+	# group requests by method, host and path, with ids in the path left out
+	# paths go collection/id/collection/..., so every second part after the version is an id
+	split_url = urlsplit(url)
+	parts = [part for part in split_url.path.split("/") if part]
+	start = 1 if parts and re.fullmatch(r"v\d+", parts[0]) else 0
+
+	path = "/".join(part if i < start or (i - start) % 2 == 0 else "{id}" for i, part in enumerate(parts))
+
+	return f"{method.upper()} {split_url.netloc}/{path}"
+
+
+def get_retry_after(response):
+	# seconds the server asked to wait, or None if it didn't say
+	if response is None:
+		return None
+
+	try:
+		return float(response.headers["Retry-After"])
+	except (KeyError, ValueError):
+		return None
@@ -0,0 +1,202 @@
+import cProfile
+import csv
+import functools
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+import numpy as np
+
+# load env variables
+load_dotenv()
+
+# time the instrumented functions and sections, and save a report when the script ends
+# when it's off, decorated functions are left as they are and sections cost nothing
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "0") == "1"
+
+# folder the reports are saved in, one per script, as json or csv
+INSTRUMENTATION_DIR = os.getenv("INSTRUMENTATION_DIR", "data/instrumentation")
+INSTRUMENTATION_FORMAT = os.getenv("INSTRUMENTATION_FORMAT", "json")
+
+# also run the whole script under cProfile and save its stats next to the report (open them with pstats or snakeviz)
+# cProfile only sees the main thread, worker threads and processes only show up in the timers
+INSTRUMENTATION_PROFILE = os.getenv("INSTRUMENTATION_PROFILE", "0") == "1"
+
+# name -> [seconds of each call, items handled]
+# counters only have items, with no seconds
+records = {}
+records_lock = threading.Lock()
+
+
+class Timer:
+	# times one section, items can be set inside it once they're known
+
+	def __init__(self, name, items=1):
+		self.name = name
+		self.items = items
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		add(self.name, time.perf_counter() - self.start, self.items)
+
+
+class NullTimer:
+	# what timer gives back when instrumentation is off
+
+	items = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		pass
+
+
+null_timer = NullTimer()
+
+
+def timed(name=None, items_arg=None):
+	# decorator that times every call of a function
+	# items_arg is the position of the argument the call works through, its length is counted as the items handled
+	# without it every call counts as one item
+	def decorator(function):
+		if not INSTRUMENTATION:
+			return function
+
+		record_name = name or function.__name__
+
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			start = time.perf_counter()
+
+			try:
+				return function(*args, **kwargs)
+			finally:
+				items = len(args[items_arg]) if items_arg is not None else 1
+				add(record_name, time.perf_counter() - start, items)
+
+		return wrapper
+
+	return decorator
+
+
+def timer(name, items=1):
+	# context manager that times a section of code
+	return Timer(name, items) if INSTRUMENTATION else null_timer
+
+
+def count(name, items=1):
+	# counter for things that aren't timed, like cache hits
+	if INSTRUMENTATION:
+		add(name, None, items)
+
+
+def add(name, seconds, items):
+	with records_lock:
+		if name not in records:
+			records[name] = [[], 0]
+
+		record = records[name]
+
+		if seconds is not None:
+			record[0].append(seconds)
+
+		record[1] += items
+
+
+def take_records():
+	# hands over everything recorded so far and starts over
+	# worker processes send these back with their results, since they can't add to the main process's records
+	with records_lock:
+		taken = dict(records)
+		records.clear()
+
+	return taken
+
+
+def merge_records(other_records):
+	with records_lock:
+		for name, (seconds, items) in other_records.items():
+			if name not in records:
+				records[name] = [[], 0]
+
+			records[name][0].extend(seconds)
+			records[name][1] += items
+
+
+def get_report():
+	# one row per name, slowest first
+	report = []
+
+	with records_lock:
+		items = list(records.items())
+
+	for name, (seconds, item_count) in items:
+		seconds = np.array(seconds)
+		total = float(seconds.sum())
+
+		report.append({
+			"name": name,
+			"calls": len(seconds),
+			"total_seconds": total,
+			"mean_ms": float(seconds.mean() * 1000) if len(seconds) else None,
+			"p95_ms": float(np.percentile(seconds, 95) * 1000) if len(seconds) else None,
+			"items": item_count,
+			"items_per_second": item_count / total if item_count and total > 0 else None
+		})
+
+	report.sort(key=lambda row: row["total_seconds"], reverse=True)
+
+	return report
+
+
+def save_report(script_name, wall_seconds):
+	os.makedirs(INSTRUMENTATION_DIR, exist_ok=True)
+	report = get_report()
+
+	if INSTRUMENTATION_FORMAT == "csv":
+		path = os.path.join(INSTRUMENTATION_DIR, f"{script_name}.csv")
+
+		with open(path, "w", encoding="utf-8", newline="") as f:
+			writer = csv.DictWriter(f, fieldnames=["name", "calls", "total_seconds", "mean_ms", "p95_ms", "items", "items_per_second"])
+			writer.writeheader()
+			writer.writerows(report)
+	else:
+		path = os.path.join(INSTRUMENTATION_DIR, f"{script_name}.json")
+
+		with open(path, "w", encoding="utf-8") as f:
+			json.dump({"script": script_name, "wall_seconds": wall_seconds, "functions": report}, f, indent=2)
+
+	print(f"Instrumentation report saved to {path}")
+
+
+def run(main, script_name):
+	# runs a script's main, saving the report and profile even if it exits early or fails
+	if not INSTRUMENTATION and not INSTRUMENTATION_PROFILE:
+		return main()
+
+	profiler = cProfile.Profile() if INSTRUMENTATION_PROFILE else None
+	start = time.perf_counter()
+
+	if profiler is not None:
+		profiler.enable()
+
+	try:
+		return main()
+	finally:
+		wall_seconds = time.perf_counter() - start
+
+		if profiler is not None:
+			profiler.disable()
+			os.makedirs(INSTRUMENTATION_DIR, exist_ok=True)
+
+			path = os.path.join(INSTRUMENTATION_DIR, f"{script_name}.prof")
+			profiler.dump_stats(path)
+			print(f"Profile saved to {path}")
+
+		if INSTRUMENTATION:
+			save_report(script_name, wall_seconds)
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+	# allows rate requests per second on average, with up to burst requests at once after being idle
+	# requests wait their turn in order, and a 429 from the server pauses everything for its retry hint
+
+	def __init__(self, rate, burst=1):
+		self.rate = rate
+		self.burst = burst
+
+		self.tokens = burst
+		self.updated = time.monotonic()
+		self.blocked_until = 0.0
+		self.lock = asyncio.Lock()
+
+		# counters
+		self.requests = 0
+		self.waits = 0
+		self.wait_time = 0.0
+		self.throttles = 0
+
+	def get_delay(self):
+		# how long until the next request can go, taking its token if it can go now
+		now = time.monotonic()
+
+		if now < self.blocked_until:
+			return self.blocked_until - now
+
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+		if self.tokens >= 1:
+			self.tokens -= 1
+			return 0.0
+
+		return (1 - self.tokens) / self.rate
+
+	async def acquire(self):
+		async with self.lock:
+			self.requests += 1
+			start = time.monotonic()
+
+			delay = self.get_delay()
+			if delay > 0:
+				self.waits += 1
+
+			# other coroutines keep running while this one waits
+			while delay > 0:
+				await asyncio.sleep(delay)
+				delay = self.get_delay()
+
+			self.wait_time += time.monotonic() - start
+
+	def throttle(self, retry_after):
+		# the server said we're going too fast, so nothing goes through until it says to retry
+		self.throttles += 1
+		# tokens only start coming back once the wait is over
+		self.tokens = 0
+		self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+		self.updated = self.blocked_until
+
+	def get_report(self):
+		return f"{self.requests} requests, waited {self.waits} times for {self.wait_time:.1f}s, throttled {self.throttles} times"
+
+
+class ThreadTokenBucket(TokenBucket):
+	# the same limits shared by threads instead of coroutines
+
+	def __init__(self, rate, burst=1):
+		super().__init__(rate, burst)
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		with self.lock:
+			self.requests += 1
+			start = time.monotonic()
+
+			delay = self.get_delay()
+			if delay > 0:
+				self.waits += 1
+
+			while delay > 0:
+				time.sleep(delay)
+				delay = self.get_delay()
+
+			self.wait_time += time.monotonic() - start
+
+	def throttle(self, retry_after):
+		with self.lock:
+			super().throttle(retry_after)
+
+
+def get_retry_after(error):
+	# seconds the server asked to wait before retrying, or None if the error isn't a rate limit
+	retry_after = getattr(error, "retry_after", None)
+	if retry_after is not None:
+		return float(retry_after)
+
+	if getattr(error, "status", None) != 429:
+		return None
+
+	response = getattr(error, "response", None)
+	headers = getattr(response, "headers", None) or {}
+
+	try:
+		return float(headers.get("Retry-After", 1))
+	except ValueError:
+		return 1.0
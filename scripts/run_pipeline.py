@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from storage import get_path
+
+# load env variables
+load_dotenv()
+
+# how many stages can run at the same time
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+
+# comma separated stages to run, along with the stages they depend on (empty runs every stage)
+PIPELINE_STAGES = os.getenv("PIPELINE_STAGES", "")
+
+# run the named stages (or every stage) even if their inputs haven't changed, the stages they depend on still get checked
+PIPELINE_FORCE = os.getenv("PIPELINE_FORCE", "0") == "1"
+
+# hashes of the inputs each stage last ran with
+PIPELINE_STATE_PATH = os.getenv("PIPELINE_STATE_PATH", "data/pipeline_state.json")
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CORRELATION_FILES = [f"data/{name}_correlations.csv" for name in ("pearson", "spearman", "kendall")]
+HEATMAP_FILES = [f"data/{name}_heatmap.png" for name in ("pearson", "spearman", "kendall")]
+
+# every stage with the script it runs, the files it reads and the files it writes
+# a stage depends on the stages that write its inputs
+# resumable stages keep track of their own progress, so they always run and their outputs decide what runs after them
+# env is added to the stage's environment
+STAGES = [
+	{"name": "servers", "script": "get_server_sample.py", "inputs": [], "outputs": ["data/servers.json"]},
+	{"name": "users", "script": "get_user_sample.py", "inputs": [], "outputs": [get_path("users")]},
+	{"name": "messages", "script": "analyze_messages.py", "inputs": [get_path("users")], "outputs": [get_path("messages_data")]},
+	{"name": "spotify", "script": "analyze_spotify_profiles.py", "inputs": [get_path("users")], "outputs": [get_path("spotify_data")], "resumable": True},
+	{"name": "correlations", "script": "analyze_correlations.py", "inputs": [get_path("messages_data"), get_path("spotify_data")], "outputs": ["data/messages_and_spotify_data.csv"] + CORRELATION_FILES},
+	{"name": "heatmaps", "script": "create_heatmaps.py", "inputs": CORRELATION_FILES, "outputs": HEATMAP_FILES, "env": {"HEATMAP_SHOW": "0", "MPLBACKEND": "Agg"}}
+]
+
+def main():
+	state = load_state()
+	stages = select_stages(STAGES, PIPELINE_STAGES)
+	dependencies = get_dependencies(stages)
+
+	forced = set()
+	if PIPELINE_FORCE:
+		forced = {name.strip() for name in PIPELINE_STAGES.split(",")} if PIPELINE_STAGES else {stage["name"] for stage in stages}
+
+	# stage name -> (status, seconds)
+	results = {}
+	start = time.perf_counter()
+
+	with ThreadPoolExecutor(max_workers=PIPELINE_WORKERS) as executor:
+		pending = list(stages)
+		running = {}
+
+		while pending or running:
+			# start every stage whose dependencies are done
+			for stage in list(pending):
+				stage_dependencies = dependencies[stage["name"]]
+
+				if any(results.get(name, ("",))[0] in ("failed", "blocked") for name in stage_dependencies):
+					results[stage["name"]] = ("blocked", 0.0)
+					pending.remove(stage)
+
+				elif all(name in results for name in stage_dependencies):
+					running[executor.submit(run_stage, stage, state, stage["name"] in forced)] = stage
+					pending.remove(stage)
+
+			if not running:
+				continue
+
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+			for future in done:
+				stage = running.pop(future)
+				status, seconds, input_hashes, known_hashes = future.result()
+				results[stage["name"]] = (status, seconds)
+
+				# state is only changed here, and saved after every stage so a failure later doesn't lose it
+				state["files"] |= known_hashes
+
+				if status == "ran":
+					state["stages"][stage["name"]] = input_hashes
+
+				save_state(state)
+
+	print_report(stages, results, time.perf_counter() - start)
+
+	if any(status in ("failed", "blocked") for status, _ in results.values()):
+		sys.exit(1)
+
+
+def select_stages(stages, names):
+	# the named stages and everything they depend on, in pipeline order
+	if not names:
+		return stages
+
+	by_name = {stage["name"]: stage for stage in stages}
+	selected = set()
+	queue = [name.strip() for name in names.split(",") if name.strip()]
+
+	while queue:
+		name = queue.pop()
+
+		if name not in by_name:
+			raise ValueError(f"Unknown pipeline stage {name!r}, expected one of {', '.join(by_name)}")
+
+		if name not in selected:
+			selected.add(name)
+			queue.extend(get_dependencies(stages)[name])
+
+	return [stage for stage in stages if stage["name"] in selected]
+
+
+def get_dependencies(stages):
+	# stage name -> names of the stages that write its inputs
+	writers = {path: stage["name"] for stage in stages for path in stage["outputs"]}
+
+	return {
+		stage["name"]: {writers[path] for path in stage["inputs"] if path in writers}
+		for stage in stages
+	}
+
+
+def run_stage(stage, state, force=False):
+	# returns the status, how long it took, the hashes of its inputs, and the known file hashes to save
+	start = time.perf_counter()
+
+	# the main thread saves the state while stages run, so hashes found here go in a copy
+	known_hashes = dict(state["files"])
+
+	missing = [path for path in stage["inputs"] if not os.path.exists(path)]
+	if missing:
+		print(f"[{stage['name']}] missing inputs: {', '.join(missing)}")
+		return "failed", 0.0, {}, {}
+
+	input_hashes = {path: get_file_hash(path, known_hashes) for path in stage["inputs"]}
+
+	if not force and is_up_to_date(stage, state, input_hashes):
+		print(f"[{stage['name']}] up to date")
+		return "up to date", time.perf_counter() - start, input_hashes, known_hashes
+
+	print(f"[{stage['name']}] running {stage['script']}")
+
+	# unbuffered so output shows up as it happens, each line marked with the stage it's from
+	process = subprocess.Popen(
+		[sys.executable, os.path.join(SCRIPTS_DIR, stage["script"])],
+		stdout=subprocess.PIPE,
+		stderr=subprocess.STDOUT,
+		text=True,
+		encoding="utf-8",
+		errors="replace",
+		env=os.environ | {"PYTHONUNBUFFERED": "1"} | stage.get("env", {})
+	)
+
+	for line in process.stdout:
+		print(f"[{stage['name']}] {line}", end="")
+
+	status = "ran" if process.wait() == 0 else "failed"
+
+	# outputs are hashed now so the stages after this one don't have to read them again
+	if status == "ran":
+		for path in stage["outputs"]:
+			if os.path.exists(path):
+				get_file_hash(path, known_hashes)
+
+	return status, time.perf_counter() - start, input_hashes, known_hashes
+
+
+def is_up_to_date(stage, state, input_hashes):
+	if stage.get("resumable"):
+		return False
+
+	if any(not os.path.exists(path) for path in stage["outputs"]):
+		return False
+
+	# stages without inputs (the samples) only run again when their outputs are gone
+	if not stage["inputs"]:
+		return True
+
+	return state["stages"].get(stage["name"]) == input_hashes
+
+
+def get_file_hash(path, known_hashes):
+	# sha256 of a file, or of every file in a folder (npy tables are folders)
+	# hashes are reused while the size and modification time stay the same, so big unchanged files aren't read again
+	if os.path.isdir(path):
+		digest = hashlib.sha256()
+
+		for root, folders, files in os.walk(path):
+			folders.sort()
+
+			for file in sorted(files):
+				file_path = os.path.join(root, file)
+				digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+				digest.update(get_file_hash(file_path, known_hashes).encode("utf-8"))
+
+		return digest.hexdigest()
+
+	stat = os.stat(path)
+	known = known_hashes.get(path)
+
+	if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+		return known[2]
+
+	digest = hashlib.sha256()
+
+	with open(path, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), b""):
+			digest.update(block)
+
+	known_hashes[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+
+	return digest.hexdigest()
+
+
+def load_state():
+	if not os.path.exists(PIPELINE_STATE_PATH):
+		return {"stages": {}, "files": {}}
+
+	with open(PIPELINE_STATE_PATH, "r", encoding="utf-8") as f:
+		return json.load(f)
+
+
+def save_state(state):
+	os.makedirs(os.path.dirname(PIPELINE_STATE_PATH) or ".", exist_ok=True)
+
+	# written to a temporary file first so a crash never leaves half a state file
+	temporary_path = PIPELINE_STATE_PATH + ".tmp"
+
+	with open(temporary_path, "w", encoding="utf-8") as f:
+		json.dump(state, f, indent=2)
+
+	os.replace(temporary_path, PIPELINE_STATE_PATH)
+
+
+def print_report(stages, results, total_time):
+	print("\nStage          Status        Time")
+
+	for stage in stages:
+		status, seconds = results.get(stage["name"], ("not run", 0.0))
+		print(f"{stage['name']:<14} {status:<13} {seconds:.1f}s")
+
+	stage_time = sum(seconds for _, seconds in results.values())
+	print(f"Total {total_time:.1f}s ({stage_time:.1f}s of stages)")
+
+
+if __name__ == "__main__":
+	main()
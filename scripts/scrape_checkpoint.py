@@ -0,0 +1,135 @@
+import json
+import os
+import secrets
+
+
+class ScrapeCheckpoint:
+	# append-only json lines file with everything scraped so far, so a restarted run can pick up where it stopped
+	# an empty path turns checkpoints off
+	# without a seed a random one is made and saved with the progress, so a restarted run gives users the same sample keys
+
+	def __init__(self, path, seed=""):
+		self.path = path
+		self.seed = seed
+		self.guilds = {}
+		self.file = None
+
+		if path and os.path.exists(path):
+			self.load()
+
+		if path:
+			os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+			self.file = open(path, "a", encoding="utf-8")
+
+		if not self.seed:
+			self.seed = secrets.token_hex(16)
+			self.write({"type": "seed", "seed": self.seed})
+
+	def load(self):
+		with open(self.path, "r", encoding="utf-8") as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except json.JSONDecodeError:
+					# the last line might have been cut off by a crash
+					continue
+
+				if record["type"] == "seed":
+					self.seed = self.seed or record["seed"]
+				else:
+					self.get_guild(record["guild"]).add(record)
+
+		print(f"Resuming from checkpoint {self.path}")
+
+	def get_guild(self, guild_id):
+		if guild_id not in self.guilds:
+			self.guilds[guild_id] = GuildCheckpoint(self, guild_id)
+
+		return self.guilds[guild_id]
+
+	def write(self, record):
+		if self.file is None:
+			return
+
+		self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+		self.file.flush()
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+
+
+class GuildCheckpoint:
+	# progress of one server, either loaded from the file or saved as it happens
+
+	def __init__(self, checkpoint, guild_id):
+		self.checkpoint = checkpoint
+		self.guild_id = guild_id
+
+		# channel id -> index, messages scanned, last message id, done and the (author id, content) pairs saved
+		self.channels = {}
+
+		# author id -> spotify url, failed lookups are in failed_users
+		self.spotify_urls = {}
+		self.failed_users = set()
+
+		self.done = False
+
+	def add(self, record):
+		if record["type"] == "messages":
+			channel = self.get_channel(record["channel"], record["channel_index"])
+			channel["scanned"] += record["scanned"]
+			channel["last_message_id"] = record["last_message_id"] or channel["last_message_id"]
+			channel["done"] = record["done"]
+			channel["messages"].extend(record["messages"])
+
+		elif record["type"] == "profile":
+			if record["failed"]:
+				self.failed_users.add(record["author"])
+			else:
+				self.spotify_urls[record["author"]] = record["spotify_url"]
+
+		elif record["type"] == "guild_done":
+			self.done = True
+
+	def get_channel(self, channel_id, channel_index):
+		if channel_id not in self.channels:
+			self.channels[channel_id] = {
+				"index": channel_index,
+				"scanned": 0,
+				"last_message_id": None,
+				"done": False,
+				"messages": []
+			}
+
+		return self.channels[channel_id]
+
+	def save_messages(self, channel_id, channel_index, messages, scanned, last_message_id, done):
+		# messages are (author id, content) pairs, scanned also counts the messages that were skipped
+		self.checkpoint.write({
+			"type": "messages",
+			"guild": self.guild_id,
+			"channel": channel_id,
+			"channel_index": channel_index,
+			"scanned": scanned,
+			"last_message_id": last_message_id,
+			"done": done,
+			"messages": messages
+		})
+
+	def save_profile(self, author_id, spotify_url, failed):
+		self.checkpoint.write({
+			"type": "profile",
+			"guild": self.guild_id,
+			"author": author_id,
+			"spotify_url": spotify_url,
+			"failed": failed
+		})
+
+	def save_done(self):
+		self.checkpoint.write({"type": "guild_done", "guild": self.guild_id})
+
+	def clear_messages(self):
+		# replayed messages aren't needed once they're back in memory
+		for channel in self.channels.values():
+			channel["messages"] = []
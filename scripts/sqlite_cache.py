@@ -0,0 +1,81 @@
+import json
+import sqlite3
+import threading
+import time
+
+# sqlite limits how many parameters a query can have
+QUERY_BATCH_SIZE = 500
+
+
+class SqliteCache:
+	# persistent key-value cache of json values stored in a local sqlite file
+	# ttl is how many seconds an entry is used for, and max_entries how many are kept before the oldest are dropped
+	# it can be shared by threads
+
+	def __init__(self, path, table, ttl=None, max_entries=None):
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.lock = threading.Lock()
+		self.table = table
+		self.ttl = ttl
+		self.max_entries = max_entries
+
+		self.hits = 0
+		self.misses = 0
+
+		with self.connection:
+			self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)")
+			self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_updated ON {table} (updated)")
+
+		# rough number of entries, only counted again when it goes over max_entries
+		self.size = self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+	def get_many(self, keys):
+		# returns a dict with the keys that were found and haven't expired
+		found = {}
+		unique_keys = list(dict.fromkeys(keys))
+		oldest = time.time() - self.ttl if self.ttl else 0
+
+		with self.lock:
+			for i in range(0, len(unique_keys), QUERY_BATCH_SIZE):
+				batch = unique_keys[i:i + QUERY_BATCH_SIZE]
+				placeholders = ",".join("?" * len(batch))
+
+				rows = self.connection.execute(f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders}) AND updated >= ?", batch + [oldest])
+				found |= {key: json.loads(value) for key, value in rows}
+
+			hits = sum(1 for key in keys if key in found)
+			self.hits += hits
+			self.misses += len(keys) - hits
+
+		return found
+
+	def set_many(self, items):
+		now = time.time()
+
+		with self.lock:
+			with self.connection:
+				self.connection.executemany(
+					f"INSERT OR REPLACE INTO {self.table} (key, value, updated) VALUES (?, ?, ?)",
+					[(key, json.dumps(value), now) for key, value in items.items()]
+				)
+
+			self.size += len(items)
+
+			if self.max_entries and self.size > self.max_entries:
+				self.evict()
+
+	def evict(self):
+		# drop expired entries, then the oldest ones until it's back to max_entries
+		with self.connection:
+			if self.ttl:
+				self.connection.execute(f"DELETE FROM {self.table} WHERE updated < ?", (time.time() - self.ttl,))
+
+			self.connection.execute(
+				f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+				(self.max_entries,)
+			)
+
+		self.size = self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+	def close(self):
+		self.connection.close()
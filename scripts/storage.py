@@ -0,0 +1,377 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from users_reader import iter_users as iter_json_users, USER_STRATA
+
+# pyarrow is optional, the columnar format falls back to .npy columns without it
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = None
+	pq = None
+
+# load env variables
+load_dotenv()
+
+# how data passed between the scripts is stored
+# json: indented json files like data/users.json
+# columnar: parquet files, or folders of memory-mapped .npy columns if pyarrow isn't installed
+DATA_FORMAT = os.getenv("DATA_FORMAT", "json")
+
+DATA_DIR = "data"
+
+# how many rows go in each parquet row group, users are streamed one group at a time
+PARQUET_ROW_GROUP_SIZE = 256
+
+# server fields are repeated on every user row in the columnar users table
+SERVER_FIELD_PREFIX = "server_"
+
+
+def get_backend():
+	if DATA_FORMAT == "json":
+		return "json"
+
+	if DATA_FORMAT == "columnar":
+		return "parquet" if pq is not None else "npy"
+
+	raise ValueError(f"Unknown DATA_FORMAT {DATA_FORMAT!r}, expected json or columnar")
+
+
+def get_path(name):
+	backend = get_backend()
+
+	if backend == "json":
+		return os.path.join(DATA_DIR, name + ".json")
+
+	if backend == "parquet":
+		return os.path.join(DATA_DIR, name + ".parquet")
+
+	return os.path.join(DATA_DIR, name + "_npy")
+
+
+def table_exists(name):
+	return os.path.exists(get_path(name))
+
+
+def write_records(name, records):
+	# save a list of dicts as a table
+	path = get_path(name)
+	backend = get_backend()
+
+	if backend == "json":
+		with open(path, "w", encoding="utf-8") as f:
+			json.dump(records, f, ensure_ascii=False, indent=2, default=str)
+	elif backend == "parquet":
+		columns = get_record_columns(records)
+		arrays = {}
+		json_columns = []
+
+		for col in columns:
+			values = [to_storable(r.get(col)) for r in records]
+
+			try:
+				arrays[col] = pa.array(values)
+			except (pa.ArrowInvalid, pa.ArrowTypeError):
+				# values that don't fit one arrow type are stored as json strings
+				arrays[col] = pa.array([None if v is None else json.dumps(v, ensure_ascii=False) for v in values], pa.string())
+				json_columns.append(col)
+
+		# keys each record didn't have are saved with the table, so reading it back doesn't add them
+		storage_info = {"missing": get_missing_keys(records, columns), "json_columns": json_columns}
+		table = pa.table(arrays).replace_schema_metadata({"storage": json.dumps(storage_info)})
+		pq.write_table(table, path, row_group_size=PARQUET_ROW_GROUP_SIZE)
+	else:
+		write_npy_table(path, records)
+
+
+def read_records(name):
+	# load a table back as a list of dicts
+	path = get_path(name)
+	backend = get_backend()
+
+	if backend == "json":
+		with open(path, "r", encoding="utf-8") as f:
+			return json.load(f)
+
+	if backend == "parquet":
+		table = pq.read_table(path)
+		storage_info = get_parquet_storage_info(table.schema)
+		rows = (decode_json_columns(row, storage_info["json_columns"]) for row in table.to_pylist())
+	else:
+		storage_info = read_npy_manifest(path)
+		rows = iter_npy_rows(path)
+
+	# columnar tables fill in keys records didn't have, so drop just those to get back the original records
+	# values that were None to begin with stay
+	missing = {col: set(indexes) for col, indexes in storage_info["missing"].items()}
+
+	if not missing:
+		return list(rows)
+
+	return [{k: v for k, v in row.items() if k not in missing or i not in missing[k]} for i, row in enumerate(rows)]
+
+
+def read_columns(name):
+	# load a table as a data frame a column at a time instead of going through records
+	path = get_path(name)
+	backend = get_backend()
+
+	if backend == "json":
+		with open(path, "r", encoding="utf-8") as f:
+			return pd.DataFrame(json.load(f))
+
+	if backend == "parquet":
+		table = pq.read_table(path)
+		df = table.to_pandas()
+
+		for col in get_parquet_storage_info(table.schema)["json_columns"]:
+			df[col] = df[col].map(lambda v: None if v is None else json.loads(v))
+
+		return df
+
+	manifest = read_npy_manifest(path)
+	columns = {}
+
+	for i, column in enumerate(manifest["columns"]):
+		columns[column["name"]] = read_npy_column(path, i, column["kind"])
+
+	return pd.DataFrame(columns)
+
+
+def write_users(server_samples):
+	if get_backend() == "json":
+		write_records("users", server_samples)
+		return
+
+	# one row per user, with the server fields repeated on each row
+	rows = []
+
+	for server in server_samples:
+		server_fields = {SERVER_FIELD_PREFIX + k: to_storable(v) for k, v in server.items() if k not in USER_STRATA}
+
+		for stratum in USER_STRATA:
+			for user_id, user in server[stratum].items():
+				row = server_fields | {"stratum": stratum, "user_id": str(user_id)}
+				row |= {k: to_storable(v) for k, v in user.items()}
+				rows.append(row)
+
+	write_records("users", rows)
+
+
+def iter_users():
+	# yields (server, stratum, user_id, user) one user at a time
+	path = get_path("users")
+	backend = get_backend()
+
+	if backend == "json":
+		yield from iter_json_users(path)
+		return
+
+	if backend == "parquet":
+		parquet_file = pq.ParquetFile(path)
+		json_columns = get_parquet_storage_info(parquet_file.schema_arrow)["json_columns"]
+
+		rows = (
+			decode_json_columns(row, json_columns)
+			for batch in parquet_file.iter_batches(batch_size=PARQUET_ROW_GROUP_SIZE)
+			for row in batch.to_pylist()
+		)
+	else:
+		rows = iter_npy_rows(path)
+
+	for row in rows:
+		server = {}
+		user = {}
+
+		for key, value in row.items():
+			if key.startswith(SERVER_FIELD_PREFIX):
+				server[key[len(SERVER_FIELD_PREFIX):]] = value
+			elif key not in ("stratum", "user_id"):
+				user[key] = value
+
+		yield server, row["stratum"], row["user_id"], user
+
+
+def get_record_columns(records):
+	# records don't all have the same keys, so use every key in the order it first appears
+	return list(dict.fromkeys(key for record in records for key in record))
+
+
+def get_missing_keys(records, columns):
+	# column -> rows that didn't have the key, for the columns some rows don't have
+	missing = {}
+
+	for col in columns:
+		indexes = [i for i, record in enumerate(records) if col not in record]
+
+		if indexes:
+			missing[col] = indexes
+
+	return missing
+
+
+def get_parquet_storage_info(schema):
+	# the missing keys and json columns write_records saved with the table
+	return json.loads(schema.metadata[b"storage"])
+
+
+def decode_json_columns(row, json_columns):
+	for col in json_columns:
+		if row.get(col) is not None:
+			row[col] = json.loads(row[col])
+
+	return row
+
+
+def to_storable(value):
+	# anything that isn't a number, string or list of strings (like discord objects) is stored as a string
+	if value is None or isinstance(value, (bool, int, float, str, np.number)):
+		return value
+
+	if isinstance(value, (list, tuple)):
+		return [str(v) for v in value]
+
+	return str(value)
+
+
+def get_column_kind(values):
+	# kind that fits every value that isn't missing, columns that mix kinds are stored as json
+	kinds = set()
+
+	for value in values:
+		if value is None:
+			continue
+
+		if isinstance(value, list):
+			kinds.add("string_list")
+		elif isinstance(value, str):
+			kinds.add("string")
+		else:
+			kinds.add("number")
+
+	if len(kinds) > 1:
+		return "json"
+
+	return kinds.pop() if kinds else "number"
+
+
+def write_npy_table(path, records):
+	os.makedirs(path, exist_ok=True)
+
+	columns = get_record_columns(records)
+
+	# keys each record didn't have are saved too, so reading the table back doesn't add them
+	manifest = {"rows": len(records), "columns": [], "missing": get_missing_keys(records, columns)}
+
+	for i, name in enumerate(columns):
+		values = [to_storable(r.get(name)) for r in records]
+		kind = get_column_kind(values)
+
+		if kind == "number":
+			# keep integers as integers unless there are missing values
+			if all(isinstance(v, (int, np.integer)) for v in values):
+				np.save(os.path.join(path, f"{i}.npy"), np.array(values, dtype=np.int64))
+			else:
+				floats = [np.nan if v is None else v for v in values]
+				np.save(os.path.join(path, f"{i}.npy"), np.array(floats, dtype=np.float64))
+
+		elif kind == "string":
+			np.save(os.path.join(path, f"{i}.nulls.npy"), np.array([v is None for v in values], dtype=bool))
+			save_npy_strings(path, i, ["" if v is None else v for v in values])
+
+		elif kind == "json":
+			np.save(os.path.join(path, f"{i}.nulls.npy"), np.array([v is None for v in values], dtype=bool))
+			save_npy_strings(path, i, ["" if v is None else json.dumps(v, ensure_ascii=False) for v in values])
+
+		else:
+			# strings of every row go in one buffer, with the row boundaries saved separately
+			lengths = [0 if v is None else len(v) for v in values]
+			np.save(os.path.join(path, f"{i}.rows.npy"), np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))))
+			np.save(os.path.join(path, f"{i}.nulls.npy"), np.array([v is None for v in values], dtype=bool))
+			save_npy_strings(path, i, [s for v in values if v is not None for s in v])
+
+		manifest["columns"].append({"name": name, "kind": kind})
+
+	# write the manifest last so a half written table isn't picked up
+	with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+		json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def save_npy_strings(path, i, strings):
+	# utf-8 bytes of every string in one buffer, plus where each string starts
+	encoded = [s.encode("utf-8", "surrogatepass") for s in strings]
+	offsets = np.concatenate(([0], np.cumsum([len(e) for e in encoded], dtype=np.int64)))
+
+	np.save(os.path.join(path, f"{i}.data.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+	np.save(os.path.join(path, f"{i}.offsets.npy"), offsets)
+
+
+def read_npy_manifest(path):
+	with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+		return json.load(f)
+
+
+def load_npy(path, filename):
+	return np.load(os.path.join(path, filename), mmap_mode="r")
+
+
+def get_npy_string(data, offsets, i):
+	return bytes(data[offsets[i]:offsets[i + 1]]).decode("utf-8", "surrogatepass")
+
+
+def read_npy_column(path, i, kind):
+	if kind == "number":
+		return load_npy(path, f"{i}.npy")
+
+	data = load_npy(path, f"{i}.data.npy")
+	offsets = load_npy(path, f"{i}.offsets.npy")
+
+	if kind == "string":
+		nulls = load_npy(path, f"{i}.nulls.npy")
+		return [None if nulls[r] else get_npy_string(data, offsets, r) for r in range(len(nulls))]
+
+	if kind == "json":
+		nulls = load_npy(path, f"{i}.nulls.npy")
+		return [None if nulls[r] else json.loads(get_npy_string(data, offsets, r)) for r in range(len(nulls))]
+
+	rows = load_npy(path, f"{i}.rows.npy")
+	nulls = load_npy(path, f"{i}.nulls.npy")
+	return [None if nulls[r] else [get_npy_string(data, offsets, s) for s in range(rows[r], rows[r + 1])] for r in range(len(rows) - 1)]
+
+
+def iter_npy_rows(path):
+	# rows are decoded one at a time from the memory-mapped columns
+	manifest = read_npy_manifest(path)
+	columns = []
+
+	for i, column in enumerate(manifest["columns"]):
+		if column["kind"] == "number":
+			arrays = (load_npy(path, f"{i}.npy"),)
+		elif column["kind"] in ("string", "json"):
+			arrays = (load_npy(path, f"{i}.data.npy"), load_npy(path, f"{i}.offsets.npy"), load_npy(path, f"{i}.nulls.npy"))
+		else:
+			arrays = (load_npy(path, f"{i}.data.npy"), load_npy(path, f"{i}.offsets.npy"), load_npy(path, f"{i}.rows.npy"), load_npy(path, f"{i}.nulls.npy"))
+
+		columns.append((column["name"], column["kind"], arrays))
+
+	for r in range(manifest["rows"]):
+		row = {}
+
+		for name, kind, arrays in columns:
+			if kind == "number":
+				value = arrays[0][r].item()
+				row[name] = None if isinstance(value, float) and np.isnan(value) else value
+			elif kind == "string":
+				data, offsets, nulls = arrays
+				row[name] = None if nulls[r] else get_npy_string(data, offsets, r)
+			elif kind == "json":
+				data, offsets, nulls = arrays
+				row[name] = None if nulls[r] else json.loads(get_npy_string(data, offsets, r))
+			else:
+				data, offsets, rows, nulls = arrays
+				row[name] = None if nulls[r] else [get_npy_string(data, offsets, s) for s in range(rows[r], rows[r + 1])]
+
+		yield row
@@ -0,0 +1,105 @@
+from operator import itemgetter
+import numpy as np
+from distribution_stats import get_distributions
+
+# properties summarized from each source, in the order their stats are saved
+AUDIO_PROPERTIES = [
+	"acousticness",
+	"danceability",
+	"energy",
+	"liveness",
+	"loudness",
+	"mode",
+	"speechiness",
+	"tempo",
+	"valence"
+]
+
+METADATA_PROPERTIES = [
+	"popularity",
+	"duration_ms",
+	"explicit",
+	"release_year"
+]
+
+
+class TrackTable:
+	# reccobeats audio features and spotify metadata of a user's tracks, joined by spotify id with one row per unique track
+	# each source fills its own columns, so a track missing from one source (or a failed batch) only leaves NaN there
+	# weights are how many times each track appears throughout all playlists
+
+	def __init__(self, track_counts):
+		self.ids = list(track_counts)
+		self.indexes = {tid: i for i, tid in enumerate(self.ids)}
+		self.weights = np.fromiter(track_counts.values(), dtype=np.float64, count=len(self.ids))
+
+		# values of each track a source has by track index, turned into arrays all at once
+		# since filling numpy arrays one value at a time is slower than building them from lists
+		self.audio = {}
+		self.metadata = {}
+
+		# properties each source had for at least one track, the others are left out of the stats
+		self.audio_properties = set()
+		self.metadata_properties = set()
+
+	def add_audio(self, tracks_data):
+		# spotify id -> reccobeats audio features
+		add_tracks(self.audio, self.audio_properties, self.indexes, tracks_data, AUDIO_PROPERTIES)
+
+	def add_metadata(self, tracks_metadata):
+		# spotify id -> spotify metadata
+		add_tracks(self.metadata, self.metadata_properties, self.indexes, tracks_metadata, METADATA_PROPERTIES)
+
+	def get_values(self, source):
+		# one row per property and one column per track like get_distributions takes them, and which tracks the source has
+		properties, rows = (AUDIO_PROPERTIES, self.audio) if source == "audio" else (METADATA_PROPERTIES, self.metadata)
+
+		values = np.full((len(properties), len(self.ids)), np.nan)
+		present = np.zeros(len(self.ids), dtype=bool)
+
+		if rows:
+			indexes = np.fromiter(rows.keys(), dtype=np.int64, count=len(rows))
+
+			# missing values (None) become NaN
+			values[:, indexes] = np.array(list(rows.values()), dtype=np.float64).T
+			present[indexes] = True
+
+		return values, present
+
+	def get_distributions(self):
+		stats = {}
+
+		# each source is summarized over only the tracks it has, in the order they first appear
+		for source, properties, found in (("audio", AUDIO_PROPERTIES, self.audio_properties), ("metadata", METADATA_PROPERTIES, self.metadata_properties)):
+			values, present = self.get_values(source)
+
+			# a property no track has doesn't get any stats, not even missing ones
+			kept = [i for i, prop in enumerate(properties) if prop in found]
+
+			if present.any() and kept:
+				stats |= get_distributions(values[np.ix_(kept, present)], [properties[i] for i in kept], self.weights[present])
+
+		return stats
+
+
+def add_tracks(rows, found, indexes, tracks, properties):
+	get_values = itemgetter(*properties)
+	has_all = False
+
+	for tid, data in tracks.items():
+		index = indexes[tid]
+
+		# a track only goes in once, even if a source has it twice
+		if index in rows:
+			continue
+
+		try:
+			rows[index] = get_values(data)
+			has_all = True
+		except KeyError:
+			# properties the source left out are missing values
+			rows[index] = [data.get(prop) for prop in properties]
+			found.update(prop for prop in properties if prop in data)
+
+	if has_all:
+		found.update(properties)
@@ -0,0 +1,120 @@
+import json
+
+# how many characters to read from the file at a time
+READ_CHUNK_SIZE = 1 << 16
+
+# keys of the user samples in each server object
+USER_STRATA = ("spotify_sample", "non_spotify_sample")
+
+decoder = json.JSONDecoder()
+
+
+def iter_users(path="data/users.json"):
+	# yields (server, stratum, user_id, user) one user at a time without loading the whole file
+	# server is a dict of the server fields read so far (the samples themselves are left out)
+	with open(path, "r", encoding="utf-8") as file:
+		reader = JsonStreamReader(file)
+
+		reader.expect("[")
+		if reader.peek() == "]":
+			return
+
+		while True:
+			server = {}
+
+			reader.expect("{")
+			if reader.peek() == "}":
+				reader.read_char()
+			else:
+				while True:
+					key = reader.read_value()
+					reader.expect(":")
+
+					if key in USER_STRATA:
+						yield from iter_stratum(reader, server, key)
+					else:
+						server[key] = reader.read_value()
+
+					if reader.read_char() == "}":
+						break
+
+			if reader.read_char() == "]":
+				break
+
+
+def iter_stratum(reader, server, stratum):
+	reader.expect("{")
+	if reader.peek() == "}":
+		reader.read_char()
+		return
+
+	while True:
+		user_id = reader.read_value()
+		reader.expect(":")
+		user = reader.read_value()
+
+		yield server, stratum, user_id, user
+
+		if reader.read_char() == "}":
+			break
+
+
+class JsonStreamReader:
+	def __init__(self, file):
+		self.file = file
+		self.buffer = ""
+		self.pos = 0
+		self.eof = False
+
+	def fill(self):
+		# drop what was already parsed and read more
+		# read at least as much as is left over so huge values don't get reparsed chunk by chunk
+		self.buffer = self.buffer[self.pos:]
+		self.pos = 0
+
+		chunk = self.file.read(max(READ_CHUNK_SIZE, len(self.buffer)))
+		if not chunk:
+			self.eof = True
+
+		self.buffer += chunk
+
+	def peek(self):
+		# get the next non whitespace character without consuming it
+		while True:
+			while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+				self.pos += 1
+
+			if self.pos < len(self.buffer):
+				return self.buffer[self.pos]
+
+			if self.eof:
+				raise ValueError("Unexpected end of JSON file")
+
+			self.fill()
+
+	def read_char(self):
+		char = self.peek()
+		self.pos += 1
+		return char
+
+	def expect(self, expected):
+		char = self.read_char()
+		if char != expected:
+			raise ValueError(f"Expected {expected!r} in JSON file but found {char!r}")
+
+	def read_value(self):
+		self.peek()
+
+		while True:
+			try:
+				value, end = decoder.raw_decode(self.buffer, self.pos)
+
+				# a number at the very end of the buffer might continue in the next chunk
+				if end < len(self.buffer) or self.eof:
+					self.pos = end
+					return value
+			except json.JSONDecodeError:
+				if self.eof:
+					raise
+
+			self.fill()